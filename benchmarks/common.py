@@ -0,0 +1,68 @@
+"""
+Shared setup for the benchmark scripts in this directory.
+
+Importing this module points the app at a throwaway SQLite database (unless
+DATABASE_URL is already set) and puts the repository root on sys.path.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "marketplace_benchmark.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{DB_PATH}")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+
+import httpx
+
+from marketplace import main, models, security
+from marketplace.migrations import migrate
+from marketplace.database import SessionLocal
+
+
+async def reset_database():
+    if os.path.exists(DB_PATH):
+        os.remove(DB_PATH)
+    await migrate()
+
+
+def client():
+    # Unhandled errors come back as 500 responses, like from a real server,
+    # instead of aborting the whole run
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench")
+
+
+async def seed_users(user_type: str, count: int, password: str = "secret"):
+    """
+    Insert users directly, hashing the password once, and return
+    (user, auth headers) pairs so benchmarks don't spend their time in bcrypt.
+    """
+    hashed_password = security.get_password_hash(password)
+    async with SessionLocal() as db:
+        users = [
+            models.User(
+                email=f"{user_type}{index}@bench.example.com",
+                hashed_password=hashed_password,
+                user_type=user_type,
+            )
+            for index in range(count)
+        ]
+        db.add_all(users)
+        await db.commit()
+        for user in users:
+            await db.refresh(user)
+
+    return [
+        (user, {"Authorization": "Bearer " + security.create_access_token({"sub": user.email})})
+        for user in users
+    ]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,299 @@
+"""
+End-to-end load benchmark for the API, run in-process against a seeded
+throwaway SQLite database.
+
+    python benchmarks/load.py --concurrency 20 --duration 30
+    python benchmarks/load.py --mix browse --output before.json
+    python benchmarks/load.py --compare before.json
+    CATALOG_SNAPSHOT_PATH=/tmp/bench-catalog.snap python benchmarks/load.py
+
+Virtual users pick actions from a weighted mix (login, catalog browsing,
+order placement, seller order management) until the duration is up. The
+report lists throughput and p50/p95/p99 latency per route and is saved as
+JSON, by default to benchmarks/results/<commit>.json, so runs can be compared
+across commits with --compare. With CATALOG_SNAPSHOT_PATH set, catalog reads
+go through the shared snapshot and the report includes its hit rate.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+from common import SessionLocal, client, models, percentile, reset_database, seed_users
+from marketplace import crud
+from marketplace.snapshot import catalog_snapshot, run_snapshot_builder
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Action name -> weight. Every mix should add up to 100.
+MIXES = {
+    "default": {
+        "login": 2,
+        "list_products": 25,
+        "list_products_compact": 8,
+        "next_product_page": 5,
+        "product_detail": 25,
+        "place_order": 15,
+        "buyer_history": 5,
+        "seller_inventory": 5,
+        "seller_orders": 5,
+        "confirm_order": 5,
+    },
+    "browse": {
+        "list_products": 40,
+        "list_products_compact": 15,
+        "next_product_page": 10,
+        "product_detail": 35,
+    },
+    "orders": {
+        "place_order": 50,
+        "buyer_history": 15,
+        "seller_orders": 15,
+        "confirm_order": 20,
+    },
+}
+
+
+class World:
+    """
+    Seeded ids and tokens shared by the virtual users.
+    """
+
+    def __init__(self, sellers, buyers, offers, product_ids):
+        self.sellers = sellers
+        self.buyers = buyers
+        self.offers = offers
+        self.product_ids = product_ids
+        self.pending_orders = {seller.id: [] for seller, _ in sellers}
+
+
+async def seed(products: int, sellers: int, buyers: int):
+    await reset_database()
+    seller_users = await seed_users("seller", sellers)
+    buyer_users = await seed_users("buyer", buyers)
+
+    async with SessionLocal() as db:
+        catalog = [
+            models.Product(name=f"Product {index:05d}", description=f"Benchmark product {index}")
+            for index in range(products)
+        ]
+        db.add_all(catalog)
+        await db.flush()
+        product_ids = [product.id for product in catalog]
+
+        offers = []
+        for index, product_id in enumerate(product_ids):
+            seller, _ = seller_users[index % sellers]
+            offers.append(models.SellerProduct(
+                price=round(5 + index % 50 * 1.5, 2),
+                quantity=10_000_000,
+                seller_id=seller.id,
+                product_id=product_id,
+            ))
+        db.add_all(offers)
+        await db.flush()
+        offer_rows = [(offer.seller_id, offer.id) for offer in offers]
+        # Compact listings show the summaries the endpoints would have written
+        await crud.refresh_offer_summaries(db, product_ids)
+        await db.commit()
+
+    return World(seller_users, buyer_users, offer_rows, product_ids)
+
+
+async def perform(action, http, world, rng):
+    """
+    Run one action and return (route, status code).
+    """
+    if action == "login":
+        seller, _ = rng.choice(world.sellers)
+        response = await http.post("/users/token", data={"username": seller.email, "password": "secret"})
+        return "POST /users/token", response.status_code
+
+    if action == "list_products":
+        response = await http.get("/products/", params={"limit": 50})
+        return "GET /products/", response.status_code
+
+    if action == "list_products_compact":
+        response = await http.get("/products/", params={"limit": 50, "compact": "true"})
+        return "GET /products/?compact", response.status_code
+
+    if action == "next_product_page":
+        first = await http.get("/products/", params={"limit": 20, "compact": "true"})
+        cursor = first.headers.get("x-next-cursor")
+        if cursor is None:
+            return "GET /products/?cursor", first.status_code
+        response = await http.get("/products/", params={"limit": 20, "compact": "true", "cursor": cursor})
+        return "GET /products/?cursor", response.status_code
+
+    if action == "product_detail":
+        response = await http.get(f"/products/{rng.choice(world.product_ids)}")
+        return "GET /products/{product_id}", response.status_code
+
+    if action == "place_order":
+        _, headers = rng.choice(world.buyers)
+        seller_id, offer_id = rng.choice(world.offers)
+        payload = {"seller_id": seller_id, "items": [{"seller_product_id": offer_id, "quantity": 1}]}
+        response = await http.post("/orders/", json=payload, headers=headers)
+        if response.status_code == 200:
+            world.pending_orders[seller_id].append(response.json()["id"])
+        return "POST /orders/", response.status_code
+
+    if action == "buyer_history":
+        _, headers = rng.choice(world.buyers)
+        response = await http.get("/orders/my-history", headers=headers)
+        return "GET /orders/my-history", response.status_code
+
+    if action == "seller_inventory":
+        _, headers = rng.choice(world.sellers)
+        response = await http.get("/seller/inventory", headers=headers)
+        return "GET /seller/inventory", response.status_code
+
+    if action == "seller_orders":
+        _, headers = rng.choice(world.sellers)
+        response = await http.get("/seller/orders", headers=headers)
+        return "GET /seller/orders", response.status_code
+
+    if action == "confirm_order":
+        seller, headers = rng.choice(world.sellers)
+        pending = world.pending_orders[seller.id]
+        if not pending:
+            response = await http.get("/seller/orders", headers=headers)
+            return "GET /seller/orders", response.status_code
+        order_id = pending.pop(0)
+        response = await http.put(f"/seller/orders/{order_id}", json={"status": "CONFIRMED"}, headers=headers)
+        return "PUT /seller/orders/{order_id}", response.status_code
+
+    raise ValueError(f"Unknown action {action}")
+
+
+def summarize(samples, elapsed):
+    latencies = [latency for latency, _ in samples]
+    errors = sum(1 for _, status in samples if status >= 400)
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "rps": round(len(samples) / elapsed, 2),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args):
+    world = await seed(args.products, args.sellers, args.buyers)
+    mix = MIXES[args.mix]
+    actions, weights = list(mix), list(mix.values())
+    samples = {}
+
+    # The app's startup hooks don't run in-process, start the builder here
+    builder = None
+    if catalog_snapshot is not None:
+        builder = asyncio.create_task(run_snapshot_builder())
+        while catalog_snapshot.current() is None:
+            await asyncio.sleep(0.05)
+
+    async with client() as http:
+        deadline = time.perf_counter() + args.duration
+
+        async def virtual_user(index):
+            rng = random.Random(args.seed + index)
+            while time.perf_counter() < deadline:
+                action = rng.choices(actions, weights)[0]
+                started = time.perf_counter()
+                route, status = await perform(action, http, world, rng)
+                samples.setdefault(route, []).append(((time.perf_counter() - started) * 1000, status))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(virtual_user(index) for index in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    if builder is not None:
+        builder.cancel()
+
+    everything = [sample for route_samples in samples.values() for sample in route_samples]
+    return {
+        "commit": current_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "mix": args.mix,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "products": args.products,
+            "sellers": args.sellers,
+            "buyers": args.buyers,
+            "seed": args.seed,
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "total": summarize(everything, elapsed),
+        "routes": {route: summarize(samples[route], elapsed) for route in sorted(samples)},
+        "catalog_snapshot": catalog_snapshot.stats() if catalog_snapshot is not None else None,
+    }
+
+
+def print_report(report, baseline=None):
+    print(f"commit {report['commit']}  mix={report['config']['mix']}  "
+          f"concurrency={report['config']['concurrency']}  elapsed={report['elapsed_seconds']}s")
+    header = f"{'route':34} {'count':>7} {'err':>5} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9}"
+    print(header)
+    print("-" * len(header))
+    rows = list(report["routes"].items()) + [("TOTAL", report["total"])]
+    for route, stats in rows:
+        line = (f"{route:34} {stats['count']:>7} {stats['errors']:>5} {stats['rps']:>8.1f} "
+                f"{stats['p50_ms']:>8.1f}ms {stats['p95_ms']:>7.1f}ms {stats['p99_ms']:>7.1f}ms")
+        previous = None
+        if baseline is not None:
+            previous = baseline["total"] if route == "TOTAL" else baseline["routes"].get(route)
+        if previous:
+            change = (stats["p99_ms"] - previous["p99_ms"]) / previous["p99_ms"] * 100 if previous["p99_ms"] else 0
+            line += f"  p99 {change:+.1f}% vs {baseline['commit']}"
+        print(line)
+
+    snapshot = report.get("catalog_snapshot")
+    if snapshot:
+        reads = snapshot["hits"] + snapshot["misses"]
+        print(f"\ncatalog snapshot: {snapshot['hits']}/{reads} catalog reads served from it "
+              f"({snapshot['hits'] / reads * 100 if reads else 0:.1f}%), "
+              f"{snapshot['patches']} patches, {snapshot['full_builds']} full builds")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mix", choices=sorted(MIXES), default="default")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--sellers", type=int, default=10)
+    parser.add_argument("--buyers", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="where to write the JSON report")
+    parser.add_argument("--compare", help="earlier JSON report to compare p99 latency against")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_report(report, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nSaved {output}")
@@ -0,0 +1,69 @@
+"""
+Measures how a burst of logins affects the latency of an unrelated endpoint.
+
+    python benchmarks/login_storm.py --logins 40 --mode inline
+    python benchmarks/login_storm.py --logins 40 --mode pool
+
+`inline` runs bcrypt directly on the event loop (the old behaviour), `pool`
+uses the bounded password worker pool from marketplace.security.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from common import client, percentile, reset_database, security
+
+
+async def run(logins: int, mode: str):
+    await reset_database()
+
+    if mode == "inline":
+        async def inline_job(func, *args):
+            return func(*args)
+        security.run_password_job = inline_job
+
+    async with client() as http:
+        await http.post(
+            "/users/", json={"email": "storm@example.com", "password": "secret", "user_type": "buyer"}
+        )
+
+        done = asyncio.Event()
+        latencies = []
+
+        async def probe():
+            while not done.is_set():
+                started = time.perf_counter()
+                await http.get("/")
+                latencies.append((time.perf_counter() - started) * 1000)
+                await asyncio.sleep(0.005)
+
+        async def login():
+            response = await http.post(
+                "/users/token", data={"username": "storm@example.com", "password": "secret"}
+            )
+            return response.status_code
+
+        probe_task = asyncio.create_task(probe())
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await probe_task
+
+    print(f"mode={mode} logins={logins} elapsed={elapsed:.2f}s")
+    print(f"  login statuses: { {code: statuses.count(code) for code in set(statuses)} }")
+    print(
+        f"  GET / during storm: n={len(latencies)} "
+        f"p50={statistics.median(latencies):.1f}ms "
+        f"p99={percentile(latencies, 99):.1f}ms "
+        f"max={max(latencies):.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--mode", choices=["inline", "pool"], default="pool")
+    args = parser.parse_args()
+    asyncio.run(run(args.logins, args.mode))
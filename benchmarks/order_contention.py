@@ -0,0 +1,169 @@
+"""
+Stress test for concurrent orders on a single hot SKU.
+
+    python benchmarks/order_contention.py --stock 200 --orders 500 --concurrency 50
+    python benchmarks/order_contention.py --mode holds
+    python benchmarks/order_contention.py --mode cancels
+
+Every order asks for `--quantity` units of the same seller product, so demand
+is far above stock. The script fails if more units were sold than were in
+stock, and reports accepted orders per second under contention.
+
+`--mode orders` places orders directly with POST /orders/. `--mode holds`
+reserves stock with POST /orders/reservations first and checks successful
+holds out with POST /orders/reservations/checkout. `--mode cancels` places
+orders directly, then has the seller race to cancel every accepted order
+several times over, through both PUT /seller/orders/{order_id} and the bulk
+endpoint, and to set it back to PENDING. Each order must be restocked at most
+once, so it fails if stock ends up above what the remaining orders left.
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+from sqlalchemy import func, select
+
+from common import SessionLocal, client, models, reset_database, seed_users
+
+
+async def run(mode: str, stock: int, orders: int, concurrency: int, quantity: int):
+    await reset_database()
+    (seller, seller_headers), = await seed_users("seller", 1)
+    buyers = await seed_users("buyer", concurrency)
+
+    async with SessionLocal() as db:
+        product = models.Product(name="Hot SKU", description="Flash sale")
+        db.add(product)
+        await db.flush()
+        hot_item = models.SellerProduct(
+            price=9.99, quantity=stock, seller_id=seller.id, product_id=product.id
+        )
+        db.add(hot_item)
+        await db.flush()
+        hot_item_id = hot_item.id
+        await db.commit()
+
+    payload = {"seller_id": seller.id, "items": [{"seller_product_id": hot_item_id, "quantity": quantity}]}
+    hold_payload = {"seller_product_id": hot_item_id, "quantity": quantity}
+    queue = asyncio.Queue()
+    for _ in range(orders):
+        queue.put_nowait(None)
+    statuses = {}
+    hold_statuses = {}
+    hold_seconds = 0.0
+
+    order_ids = []
+    cancel_statuses = {}
+
+    async with client() as http:
+        async def place_order(headers):
+            nonlocal hold_seconds
+            if mode != "holds":
+                return await http.post("/orders/", json=payload, headers=headers)
+
+            hold_started = time.perf_counter()
+            hold = await http.post("/orders/reservations", json=hold_payload, headers=headers)
+            hold_seconds += time.perf_counter() - hold_started
+            hold_statuses[hold.status_code] = hold_statuses.get(hold.status_code, 0) + 1
+            if hold.status_code != 200:
+                return hold
+            return await http.post(
+                "/orders/reservations/checkout", json={"reservation_ids": [hold.json()["id"]]}, headers=headers
+            )
+
+        async def buyer(headers):
+            while not queue.empty():
+                queue.get_nowait()
+                response = await place_order(headers)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code == 200:
+                    order_ids.append(response.json()["id"])
+
+        started = time.perf_counter()
+        await asyncio.gather(*(buyer(headers) for _, headers in buyers))
+        elapsed = time.perf_counter() - started
+
+        if mode == "cancels":
+            attempts = []
+            for order_id in order_ids:
+                attempts += [
+                    ("PUT", order_id, "CANCELED"), ("PUT", order_id, "CANCELED"), ("PUT", order_id, "PENDING"),
+                    ("BULK", order_id, "CANCELED"), ("BULK", order_id, "CANCELED"),
+                ]
+            random.Random(1).shuffle(attempts)
+            for attempt in attempts:
+                queue.put_nowait(attempt)
+
+            async def cancel():
+                while not queue.empty():
+                    kind, order_id, status = queue.get_nowait()
+                    if kind == "PUT":
+                        response = await http.put(f"/seller/orders/{order_id}", json={"status": status}, headers=seller_headers)
+                        outcome = f"PUT {status} {response.status_code}"
+                    else:
+                        response = await http.post(
+                            "/seller/orders/status", json={"order_ids": [order_id], "status": status}, headers=seller_headers
+                        )
+                        outcome = f"BULK {status} {response.status_code} " + ("updated" if response.json().get("updated") else "rejected")
+                    cancel_statuses[outcome] = cancel_statuses.get(outcome, 0) + 1
+
+            await asyncio.gather(*(cancel() for _ in range(concurrency)))
+
+    async with SessionLocal() as db:
+        remaining = await db.scalar(
+            select(models.SellerProduct.quantity).filter(models.SellerProduct.id == hot_item_id)
+        )
+        sold = await db.scalar(
+            select(func.coalesce(func.sum(models.OrderItem.quantity), 0))
+            .filter(models.OrderItem.seller_product_id == hot_item_id)
+        )
+
+        active = await db.scalar(
+            select(func.coalesce(func.sum(models.OrderItem.quantity), 0))
+            .join(models.Order, models.OrderItem.order)
+            .filter(models.OrderItem.seller_product_id == hot_item_id, models.Order.status != "CANCELED")
+        )
+        held = await db.scalar(
+            select(func.coalesce(func.sum(models.Reservation.quantity), 0))
+            .filter(models.Reservation.seller_product_id == hot_item_id)
+        )
+
+    accepted = statuses.get(200, 0)
+    print(f"mode={mode} stock={stock} orders={orders} concurrency={concurrency} quantity={quantity}")
+    print(f"  statuses: {statuses}")
+    print(f"  sold={sold} remaining={remaining} elapsed={elapsed:.2f}s")
+    print(f"  accepted orders/s={accepted / elapsed:.1f} attempts/s={orders / elapsed:.1f}")
+    if mode == "holds":
+        print(f"  hold statuses: {hold_statuses}")
+        print(f"  mean hold latency={hold_seconds / orders * 1000:.1f}ms")
+        if held:
+            print(f"  HELD: {held} units still reserved after checkout")
+            return 1
+
+    if mode == "cancels":
+        print(f"  cancel attempts: {dict(sorted(cancel_statuses.items()))}")
+        print(f"  still ordered={active} remaining={remaining}")
+        if active + remaining != stock:
+            print("  RESTOCKED: cancelled orders went back into stock more or less than once")
+            return 1
+        print("  OK: every cancelled order restocked once")
+        return 0
+
+    if remaining < 0 or sold + remaining != stock or sold != accepted * quantity:
+        print("  OVERSOLD: stock accounting does not add up")
+        return 1
+    print("  OK: no oversell")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mode", choices=["orders", "holds", "cancels"], default="orders")
+    parser.add_argument("--stock", type=int, default=200)
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--quantity", type=int, default=1)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args.mode, args.stock, args.orders, args.concurrency, args.quantity)))
@@ -0,0 +1,93 @@
+"""
+Check the number of SQL statements each write endpoint issues, as reported in
+its Server-Timing header, against a fixed budget.
+
+    python benchmarks/query_budget.py
+
+Exits non-zero when an endpoint goes over budget, so it can gate a change that
+adds round trips. Auth principals are warmed up first, so the counts cover the
+endpoint itself.
+"""
+import asyncio
+import re
+import sys
+
+from common import client, reset_database, seed_users
+
+# Statements per request, COMMIT not included
+BUDGETS = {
+    "POST /users/": 2,
+    # With its empty offer summary
+    "POST /products/": 2,
+    "POST /seller/inventory": 5,
+    # Both include the order snapshot insert
+    "POST /orders/": 10,
+    "POST /orders/checkout": 10,
+    # Includes reading the order snapshot back for the response
+    "PUT /seller/orders/{order_id}": 8,
+    "POST /seller/orders/status": 9,
+}
+
+def statement_count(response):
+    match = re.search(r'desc="(\d+) queries"', response.headers.get("server-timing", ""))
+    return int(match.group(1))
+
+async def run():
+    await reset_database()
+    (_, admin), = await seed_users("admin", 1)
+    (seller, seller_headers), *other_sellers = await seed_users("seller", 3)
+    (_, buyer), = await seed_users("buyer", 1)
+
+    counts = {}
+    async with client() as http:
+        for headers in (admin, seller_headers, buyer, *(headers for _, headers in other_sellers)):
+            response = await http.get("/users/me", headers=headers)
+            response.raise_for_status()
+
+        async def measure(name, response):
+            if response.status_code != 200:
+                raise SystemExit(f"{name} failed with {response.status_code}: {response.text}")
+            counts[name] = statement_count(response)
+            return response.json()
+
+        await measure("POST /users/", await http.post(
+            "/users/", json={"email": "new@bench.example.com", "password": "secret", "user_type": "buyer"}
+        ))
+        product = await measure("POST /products/", await http.post(
+            "/products/", json={"name": "Budget product", "description": "d"}, headers=admin
+        ))
+        offer = await measure("POST /seller/inventory", await http.post(
+            "/seller/inventory", json={"product_id": product["id"], "price": 5.0, "quantity": 10}, headers=seller_headers
+        ))
+        order = await measure("POST /orders/", await http.post(
+            "/orders/", json={"seller_id": seller.id, "items": [{"seller_product_id": offer["id"], "quantity": 2}]}, headers=buyer
+        ))
+        # A cart from three sellers, the count must not depend on how many
+        offers = [offer["id"]]
+        for _, headers in other_sellers:
+            response = await http.post(
+                "/seller/inventory", json={"product_id": product["id"], "price": 4.0, "quantity": 10}, headers=headers
+            )
+            offers.append(response.json()["id"])
+        cart = await measure("POST /orders/checkout", await http.post(
+            "/orders/checkout", json={"items": [{"seller_product_id": offer_id, "quantity": 1} for offer_id in offers]}, headers=buyer
+        ))
+        await measure("PUT /seller/orders/{order_id}", await http.put(
+            f"/seller/orders/{order['id']}", json={"status": "CONFIRMED"}, headers=seller_headers
+        ))
+        # Cancelling also restocks
+        await measure("POST /seller/orders/status", await http.post(
+            "/seller/orders/status",
+            json={"order_ids": [cart_order["id"] for cart_order in cart["orders"] if cart_order["seller_id"] == seller.id], "status": "CANCELED"},
+            headers=seller_headers
+        ))
+
+    over_budget = False
+    for name, budget in BUDGETS.items():
+        status = "ok" if counts[name] <= budget else "OVER BUDGET"
+        over_budget = over_budget or counts[name] > budget
+        print(f"{name:32} {counts[name]:3} statements (budget {budget:3})  {status}")
+    sys.exit(1 if over_budget else 0)
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,175 @@
+"""
+Micro-benchmark of response serialization cost per endpoint.
+
+    python benchmarks/serialization.py --orders 200 --items 3
+
+Loads the same ORM graphs the endpoints return and times FastAPI's default
+response_model path (validate, dump to dicts, json.dumps) against the fast
+path, checking that both produce the same bytes. The fast path is
+serialization.dump_json, and for order history and /users/me reading the
+stored order snapshots, database round trip included, with statuses changed
+after the snapshots were written. Exits non-zero when any body differs.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from sqlalchemy import select, update
+from sqlalchemy.orm import selectinload
+
+from common import SessionLocal, main, models, reset_database, seed_users
+from marketplace import crud, schemas
+from marketplace.routers import users
+from marketplace.serialization import dump_json, json_array
+
+
+def route_field(method, path):
+    for route in main.app.routes:
+        if getattr(route, "path", None) == path and method in route.methods:
+            return route.response_field
+    raise LookupError(f"{method} {path}")
+
+
+async def seed(products: int, orders: int, items: int):
+    await reset_database()
+    (seller, _), = await seed_users("seller", 1)
+    (buyer, _), = await seed_users("buyer", 1)
+
+    async with SessionLocal() as db:
+        catalog = [models.Product(name=f"Product {index}", description="Benchmark product") for index in range(products)]
+        db.add_all(catalog)
+        await db.flush()
+        offers = [
+            models.SellerProduct(price=4.25 + index, quantity=1000, seller_id=seller.id, product_id=product.id)
+            for index, product in enumerate(catalog)
+        ]
+        db.add_all(offers)
+        await db.flush()
+        for index in range(orders):
+            order = models.Order(buyer_id=buyer.id, seller_id=seller.id, total_price=0)
+            db.add(order)
+            await db.flush()
+            for item_index in range(items):
+                offer = offers[(index + item_index) % len(offers)]
+                db.add(models.OrderItem(
+                    order_id=order.id, seller_product_id=offer.id, quantity=1, price_at_purchase=offer.price
+                ))
+                order.total_price += offer.price
+        await db.commit()
+
+    async with SessionLocal() as db:
+        # Snapshotted as place_order does, then some statuses change so the
+        # status splice is covered
+        await crud.add_order_snapshots(db, await load_orders(db, select(models.Order)))
+        await db.execute(update(models.Order).filter(models.Order.id % 3 == 1).values(status="CONFIRMED"))
+        await db.execute(update(models.Order).filter(models.Order.id % 3 == 2).values(status="CANCELED"))
+        await db.commit()
+    return seller, buyer
+
+
+def order_graph():
+    return selectinload(models.Order.items).options(
+        selectinload(models.OrderItem.product_item).options(
+            selectinload(models.SellerProduct.product),
+            selectinload(models.SellerProduct.seller)
+        )
+    )
+
+
+async def load_orders(db, query):
+    # The full order graph, as the endpoints serialized it before snapshots
+    result = await db.execute(query.options(order_graph()))
+    return result.scalars().all()
+
+
+async def load_user(db, email):
+    result = await db.execute(
+        select(models.User)
+        .options(
+            selectinload(models.User.selling_products).options(
+                selectinload(models.SellerProduct.product),
+                selectinload(models.SellerProduct.seller)
+            ),
+            selectinload(models.User.purchase_orders).options(order_graph()),
+            selectinload(models.User.sale_orders).options(order_graph()),
+        )
+        .filter(models.User.email == email)
+    )
+    return result.scalars().first()
+
+
+async def run(products: int, orders: int, items: int, repeat: int):
+    seller, buyer = await seed(products, orders, items)
+
+    async with SessionLocal() as db:
+        def dumped(schema, content):
+            async def fast():
+                return dump_json(schema, content)
+            return fast
+
+        async def history(**filters):
+            page = await crud.get_order_history(db, limit=orders, **filters)
+            return json_array(body for _, _, body in page)
+
+        async def users_me():
+            principal = await crud.get_principal_by_email(db, buyer.email)
+            response = await users.read_users_me(current_user=principal, db=db)
+            return response.body
+
+        inventory = await crud.get_seller_inventory(db, seller.id)
+        product = await crud.get_product(db, 1)
+        by_created_at = (models.Order.created_at, models.Order.id)
+        cases = [
+            ("GET", "/users/me", await load_user(db, buyer.email), users_me),
+            (
+                "GET", "/orders/my-history",
+                await load_orders(db, select(models.Order).filter(models.Order.buyer_id == buyer.id).order_by(*by_created_at)),
+                lambda: history(buyer_id=buyer.id),
+            ),
+            (
+                "GET", "/seller/orders",
+                await load_orders(db, select(models.Order).filter(models.Order.seller_id == seller.id).order_by(*by_created_at)),
+                lambda: history(seller_id=seller.id),
+            ),
+            ("GET", "/seller/inventory", inventory, dumped(list[schemas.SellerProduct], inventory)),
+            ("GET", "/products/{product_id}", product, dumped(schemas.Product, product)),
+        ]
+
+        print(f"products={products} orders={orders} items/order={items} repeat={repeat}")
+        header = f"{'endpoint':26} {'bytes':>9} {'response_model':>15} {'fast path':>11} {'speedup':>8} identical"
+        print(header)
+        print("-" * len(header))
+        mismatched = False
+        for method, path, content, fast in cases:
+            field = route_field(method, path)
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                value = await serialize_response(field=field, response_content=content)
+                default_body = JSONResponse(value).body
+            default_ms = (time.perf_counter() - started) / repeat * 1000
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                fast_body = await fast()
+            fast_ms = (time.perf_counter() - started) / repeat * 1000
+
+            print(
+                f"{method + ' ' + path:26} {len(fast_body):>9} {default_ms:>13.3f}ms "
+                f"{fast_ms:>9.3f}ms {default_ms / fast_ms:>7.1f}x {default_body == fast_body}"
+            )
+            mismatched = mismatched or default_body != fast_body
+    return 1 if mismatched else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--items", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args.products, args.orders, args.items, args.repeat)))
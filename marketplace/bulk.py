@@ -0,0 +1,118 @@
+import csv
+import json
+from fastapi import Request
+from pydantic import BaseModel, ValidationError
+
+from .database import settings
+
+# Streaming parsers for the bulk ingestion endpoints. The request body is read
+# incrementally and handed out in fixed-size chunks, so memory stays bounded
+# no matter how many rows are uploaded. A line longer than
+# BULK_MAX_LINE_BYTES is skipped as it arrives and reported as a row error.
+
+CSV_CONTENT_TYPES = ("text/csv", "application/csv")
+
+async def iter_lines(request: Request, max_line_bytes: int):
+    """
+    Yield the lines of the body, None in place of a line over
+    `max_line_bytes`. Each chunk is scanned for newlines once, as it arrives.
+    """
+    line = bytearray()
+    too_long = False
+    async for chunk in request.stream():
+        view = memoryview(chunk)
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if not too_long:
+                line += view[start:len(chunk) if end == -1 else end]
+                if len(line) > max_line_bytes:
+                    too_long = True
+                    line.clear()
+            if end == -1:
+                break
+            yield None if too_long else bytes(line)
+            line.clear()
+            too_long = False
+            start = end + 1
+    if too_long:
+        yield None
+    elif line:
+        yield bytes(line)
+
+async def iter_records(request: Request):
+    """
+    Yield (row_number, record, error) for every data row of an NDJSON or CSV
+    body. CSV bodies need a header row and one record per line.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    is_csv = content_type in CSV_CONTENT_TYPES
+    header = None
+    row_number = 0
+
+    async for raw_line in iter_lines(request, settings.BULK_MAX_LINE_BYTES):
+        error = None
+        if raw_line is None:
+            line = None
+            error = f"Row is longer than {settings.BULK_MAX_LINE_BYTES} bytes"
+        else:
+            try:
+                line = raw_line.decode("utf-8").rstrip("\r")
+            except UnicodeDecodeError:
+                line = None
+                error = "Row is not valid UTF-8"
+        if line is not None and not line.strip():
+            continue
+
+        if is_csv and header is None:
+            if line is None:
+                row_number += 1
+                yield row_number, None, error
+                continue
+            header = [name.strip() for name in next(csv.reader([line]))]
+            continue
+
+        row_number += 1
+        if line is None:
+            yield row_number, None, error
+            continue
+
+        if is_csv:
+            values = next(csv.reader([line]))
+            # Empty CSV cells mean "not provided", same as a missing JSON key
+            record = {name: value for name, value in zip(header, values) if value != ""}
+        else:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if not isinstance(record, dict):
+                yield row_number, None, "Row is not a JSON object"
+                continue
+
+        yield row_number, record, None
+
+async def iter_chunks(request: Request, schema: type[BaseModel], size: int):
+    """
+    Validate rows against `schema` and yield (rows, errors) per chunk, where
+    rows are (row_number, model) pairs and errors are {"row", "detail"} dicts.
+    """
+    rows, errors = [], []
+    async for row_number, record, error in iter_records(request):
+        if error is None:
+            try:
+                rows.append((row_number, schema.model_validate(record)))
+            except ValidationError as exc:
+                error = "; ".join(
+                    f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}"
+                    for item in exc.errors()
+                )
+        if error is not None:
+            errors.append({"row": row_number, "detail": error})
+
+        if len(rows) + len(errors) >= size:
+            yield rows, errors
+            rows, errors = [], []
+
+    if rows or errors:
+        yield rows, errors
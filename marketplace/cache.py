@@ -0,0 +1,102 @@
+import hashlib
+import time
+from collections import OrderedDict
+from .database import settings
+
+class TTLCache:
+    """
+    Small in-process LRU cache whose entries expire after `ttl` seconds.
+    Not shared between gunicorn workers; every worker keeps its own copy.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Bumped on every invalidation, lets a reader that started before a
+        # write skip storing the result it computed from the old data
+        self.generation = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, generation: int | None = None):
+        if generation is not None and generation != self.generation:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self.generation += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+# Slim auth principals keyed by email, see dependencies.get_current_user
+principal_cache = TTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS
+)
+
+# Serialized catalog responses, see routers/products.py. Each worker has its
+# own copy and only sees its own writes, the TTL bounds staleness across workers.
+product_list_cache = TTLCache(
+    maxsize=settings.CATALOG_CACHE_SIZE, ttl=settings.CATALOG_CACHE_TTL_SECONDS
+)
+product_detail_cache = TTLCache(
+    maxsize=settings.CATALOG_CACHE_SIZE, ttl=settings.CATALOG_CACHE_TTL_SECONDS
+)
+
+# Called with the product ids on every catalog change, or None when any
+# product may have changed, see snapshot.py
+catalog_listeners = []
+
+def invalidate_catalog(product_ids=None):
+    if product_ids is not None:
+        product_ids = set(product_ids)
+        if not product_ids:
+            return
+    product_list_cache.clear()
+    if product_ids is None:
+        product_detail_cache.clear()
+    else:
+        for product_id in product_ids:
+            product_detail_cache.invalidate(product_id)
+    for listener in catalog_listeners:
+        listener(product_ids)
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.sha1(body).hexdigest()
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
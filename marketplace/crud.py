@@ -1,13 +1,20 @@
+import logging
+from datetime import date, datetime, timedelta, timezone
+from fastapi import HTTPException
+from sqlalchemy import and_, case, delete, func, insert, or_, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-from . import models, schemas
-from passlib.context import CryptContext
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
+from . import events, models, schemas, security
+from .cache import invalidate_catalog, principal_cache
+from .database import settings
+from .serialization import dump_json
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
+logger = logging.getLogger(__name__)
 
 async def get_user_by_email(db: AsyncSession, email: str):
     query = (
@@ -18,119 +25,324 @@ async def get_user_by_email(db: AsyncSession, email: str):
                 selectinload(models.SellerProduct.product),
                 selectinload(models.SellerProduct.seller) # Load the seller info
             ),
-            # Load purchase_orders AND all nested details
-            selectinload(models.User.purchase_orders).options(
-                selectinload(models.Order.items).options(
-                    selectinload(models.OrderItem.product_item).options(
-                        selectinload(models.SellerProduct.product),
-                        selectinload(models.SellerProduct.seller) # Also load the seller here
-                    )
-                )
-            ),
-            # Load sale_orders AND all nested details
-            selectinload(models.User.sale_orders).options(
-                selectinload(models.Order.items).options(
-                    selectinload(models.OrderItem.product_item).options(
-                        selectinload(models.SellerProduct.product),
-                        selectinload(models.SellerProduct.seller) # And also here
-                    )
-                )
-            )
+            # Purchase and sale orders come from their snapshots, see get_user_orders
         )
         .filter(models.User.email == email)
     )
     result = await db.execute(query)
     return result.scalars().first()
 
+async def get_user_credentials(db: AsyncSession, email: str):
+    # Plain user row without any relationships, enough to verify a login
+    query = select(models.User).filter(models.User.email == email)
+    result = await db.execute(query)
+    return result.scalars().first()
+
+async def get_principal_by_email(db: AsyncSession, email: str):
+    principal = principal_cache.get(email)
+    if principal is not None:
+        return principal
+
+    query = select(
+        models.User.id,
+        models.User.email,
+        models.User.user_type,
+        models.User.is_active
+    ).filter(models.User.email == email)
+    result = await db.execute(query)
+    row = result.first()
+    if row is None:
+        return None
+
+    principal = schemas.Principal.model_validate(row)
+    principal_cache.set(email, principal)
+    return principal
+
 async def create_user(db: AsyncSession, user: schemas.UserCreate):
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await security.hash_password(user.password)
     db_user = models.User(
         email=user.email, 
         hashed_password=hashed_password, 
-        user_type=user.user_type
+        user_type=user.user_type,
+        # A new user owns nothing yet, setting the collections spares loading them
+        selling_products=[],
+        purchase_orders=[],
+        sale_orders=[]
     )
     db.add(db_user)
-    await db.commit()
-    await db.refresh(db_user)
-
-    query = (
-        select(models.User)
-        .options(
-            selectinload(models.User.selling_products).options(
-                selectinload(models.SellerProduct.product)
-            ),
-            selectinload(models.User.purchase_orders).options(
-                selectinload(models.Order.items)
-            ),
-            selectinload(models.User.sale_orders).options(
-                selectinload(models.Order.items)
-            )
-        )
-        .filter(models.User.id == db_user.id)
-    )
-
-    result = await db.execute(query)
-    return result.scalars().first()
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent request registered the same email first
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Email already registered")
+    principal_cache.invalidate(db_user.email)
+    return db_user
 
 # Product CRUD Functions
+# Products start with an empty offer summary, so "no offers" reads the same
+# before the first offer as after the last one sold out
+EMPTY_OFFER_SUMMARY = {"min_price": None, "seller_count": 0, "total_quantity": 0, "best_seller_id": None}
+
 async def create_product(db: AsyncSession, product: schemas.ProductCreate):
-    db_product = models.Product(**product.model_dump())
+    db_product = models.Product(
+        **product.model_dump(), sellers=[], offer_summary=models.ProductOfferSummary(**EMPTY_OFFER_SUMMARY)
+    )
     db.add(db_product)
     await db.commit()
-    await db.refresh(db_product)
-    
-    query = select(models.Product).options(selectinload(models.Product.sellers)).filter(models.Product.id == db_product.id)
+    invalidate_catalog([db_product.id])
+    return db_product
+
+async def bulk_create_products(db: AsyncSession, products: list[schemas.ProductCreate]):
+    if not products:
+        return 0
+
+    # One multi-row INSERT for the whole chunk, and one for their summaries
+    result = await db.execute(
+        insert(models.Product).returning(models.Product.id), [product.model_dump() for product in products]
+    )
+    await db.execute(
+        insert(models.ProductOfferSummary),
+        [{"product_id": product_id, **EMPTY_OFFER_SUMMARY} for product_id in result.scalars()]
+    )
+    await db.commit()
+    invalidate_catalog()
+    return len(products)
+
+async def get_products(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    after_id: int | None = None,
+    name_prefix: str | None = None,
+    with_sellers: bool = True
+):
+    query = select(models.Product)
+    if with_sellers:
+        query = query.options(selectinload(models.Product.sellers).options(selectinload(models.SellerProduct.seller)))
+    else:
+        query = query.options(joinedload(models.Product.offer_summary))
+    if after_id is not None:
+        # Keyset pagination, seeks on the primary key instead of scanning skipped rows
+        query = query.filter(models.Product.id > after_id)
+    if name_prefix:
+        # LIKE matches the prefix exactly under any collation, Postgres looks it
+        # up in ix_products_name_pattern
+        query = query.filter(models.Product.name.startswith(name_prefix, autoescape=True))
+        if db.bind.dialect.name == "sqlite":
+            # SQLite's LIKE ignores ASCII case and skips the index. Its binary
+            # collation makes this range an exact, indexed prefix bound.
+            query = query.filter(
+                models.Product.name >= name_prefix,
+                models.Product.name < name_prefix + "\U0010ffff"
+            )
+    if skip:
+        query = query.offset(skip)
+
+    query = query.order_by(models.Product.id).limit(limit)
     result = await db.execute(query)
-    return result.scalars().first()
+    return result.scalars().all()
 
-async def get_products(db: AsyncSession, skip: int = 0, limit: int = 100):
-    query = (
+async def search_products(
+    db: AsyncSession,
+    terms: list[str],
+    limit: int = 20,
+    after: tuple[float, int] | None = None
+):
+    """
+    Full-text search over product name and description, every term matched as
+    a prefix. Returns (product, rank) pairs, best match first; `after` is the
+    (rank, id) of the last result of the previous page.
+    """
+    params = {"limit": limit}
+    if db.bind.dialect.name == "postgresql":
+        params["query"] = " & ".join(f"'{term}':*" for term in terms)
+        matches = """
+            SELECT id, -ts_rank_cd(search_vector, to_tsquery('simple', :query)) AS rank
+            FROM products WHERE search_vector @@ to_tsquery('simple', :query)
+        """
+    else:
+        params["query"] = " ".join(f'"{term}"*' for term in terms)
+        # bm25 is lower-is-better, name matches weigh ten times the description
+        matches = """
+            SELECT rowid AS id, bm25(products_fts, 10.0, 1.0) AS rank
+            FROM products_fts WHERE products_fts MATCH :query
+        """
+
+    seek = ""
+    if after is not None:
+        params["after_rank"], params["after_id"] = after
+        seek = "WHERE rank > :after_rank OR (rank = :after_rank AND id > :after_id)"
+
+    result = await db.execute(
+        text(f"SELECT id, rank FROM ({matches}) AS matches {seek} ORDER BY rank, id LIMIT :limit"),
+        params
+    )
+    ranked = result.all()
+    if not ranked:
+        return []
+
+    products = await db.execute(
         select(models.Product)
-        .options(selectinload(models.Product.sellers).options(selectinload(models.SellerProduct.seller)))
-        .offset(skip)
-        .limit(limit)
+        .options(joinedload(models.Product.offer_summary))
+        .filter(models.Product.id.in_([product_id for product_id, _ in ranked]))
+    )
+    by_id = {product.id: product for product in products.scalars()}
+    return [(by_id[product_id], rank) for product_id, rank in ranked if product_id in by_id]
+
+def upsert(db: AsyncSession, model):
+    """
+    INSERT statement for `model` that supports on_conflict_do_update on both
+    of our backends.
+    """
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    return dialect.insert(model)
+
+async def refresh_offer_summaries(db: AsyncSession, product_ids):
+    """
+    Recompute the offer summary of the given products inside the caller's
+    transaction, from their in-stock SellerProduct rows.
+    """
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return
+
+    # Concurrent writers for the same product take turns on the product row, so
+    # each one aggregates after the previous one committed. The summary row
+    # isn't locked instead, products created before their summaries were
+    # backfilled may have none. FOR NO KEY UPDATE still lets other transactions insert offers referencing
+    # the product. SQLite ignores it, it only allows one writer at a time anyway.
+    await db.execute(
+        select(models.Product.id)
+        .filter(models.Product.id.in_(product_ids))
         .order_by(models.Product.id)
+        .with_for_update(key_share=True)
+    )
+    result = await db.execute(
+        select(models.SellerProduct.product_id, models.SellerProduct.seller_id, models.SellerProduct.price, models.SellerProduct.quantity)
+        .filter(models.SellerProduct.product_id.in_(product_ids), models.SellerProduct.quantity > 0)
+        .order_by(models.SellerProduct.product_id, models.SellerProduct.price, models.SellerProduct.id)
     )
-    result = await db.execute(query)
-    return result.scalars().all()
+
+    summaries = {product_id: {"product_id": product_id, **EMPTY_OFFER_SUMMARY} for product_id in product_ids}
+    for product_id, seller_id, price, quantity in result.all():
+        summary = summaries[product_id]
+        if summary["seller_count"] == 0:
+            # Rows come cheapest first
+            summary["min_price"] = price
+            summary["best_seller_id"] = seller_id
+        summary["seller_count"] += 1
+        summary["total_quantity"] += quantity
+
+    statement = upsert(db, models.ProductOfferSummary).values(list(summaries.values()))
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=["product_id"],
+        set_={
+            column: statement.excluded[column]
+            for column in ("min_price", "seller_count", "total_quantity", "best_seller_id")
+        }
+    ))
 
 # Seller-Product CRUD Functions
 async def add_product_to_seller_inventory(db: AsyncSession, seller_product: schemas.SellerProductCreate, seller_id: int):
-    existing_entry = await db.execute(
-        select(models.SellerProduct).filter(
-            models.SellerProduct.seller_id == seller_id,
-            models.SellerProduct.product_id == seller_product.product_id
-        )
+    # Master product and seller in one round trip, both are part of the response
+    result = await db.execute(
+        select(models.Product, models.User)
+        .join(models.User, models.User.id == seller_id)
+        .filter(models.Product.id == seller_product.product_id)
     )
-    if existing_entry.scalars().first():
-        raise HTTPException(status_code=400, detail="Seller is already selling this product.")
-
-    master_product = await db.get(models.Product, seller_product.product_id)
-    if not master_product:
+    row = result.first()
+    if row is None:
         raise HTTPException(status_code=404, detail="Master product not found.")
+    master_product, seller = row
 
     db_seller_product = models.SellerProduct(
         price=seller_product.price,
         quantity=seller_product.quantity,
-        product_id=seller_product.product_id,
-        seller_id=seller_id
+        product=master_product,
+        seller=seller
     )
     db.add(db_seller_product)
-    await db.commit()
-    await db.refresh(db_seller_product)
+    try:
+        # The unique index on (seller_id, product_id) rejects duplicates here
+        await db.flush()
+        await refresh_offer_summaries(db, [seller_product.product_id])
+        events.stock_changed(
+            db, seller_id, db_seller_product.id, seller_product.product_id, db_seller_product.price, db_seller_product.quantity
+        )
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Seller is already selling this product.")
+    invalidate_catalog([seller_product.product_id])
+    return db_seller_product
 
-    query = (
-        select(models.SellerProduct)
-        .options(selectinload(models.SellerProduct.product))
-        .filter(models.SellerProduct.id == db_seller_product.id)
+async def bulk_upsert_seller_inventory(
+    db: AsyncSession, items: list[tuple[int, schemas.SellerProductCreate]], seller_id: int
+):
+    """
+    Add or update a chunk of (row_number, item) inventory rows for a seller.
+    Products the seller already sells get the new price and quantity.
+    Returns (created, updated, errors).
+    """
+    if not items:
+        return 0, 0, []
+
+    product_ids = {item.product_id for _, item in items}
+    # Master products and the seller's existing entries for them in one query
+    result = await db.execute(
+        select(models.Product.id, models.SellerProduct.id)
+        .outerjoin(
+            models.SellerProduct,
+            (models.SellerProduct.product_id == models.Product.id)
+            & (models.SellerProduct.seller_id == seller_id)
+        )
+        .filter(models.Product.id.in_(product_ids))
     )
-    result = await db.execute(query)
-    return result.scalars().first()
+    existing = {product_id: seller_product_id for product_id, seller_product_id in result.all()}
+
+    # Later rows for the same product win
+    latest, errors = {}, []
+    for row_number, item in items:
+        if item.product_id not in existing:
+            errors.append({"row": row_number, "detail": "Master product not found."})
+            continue
+        latest[item.product_id] = item
+
+    # stock_rows holds the STOCK_COLUMNS of every row, for the seller's feed
+    inserts, updates, stock_rows = [], [], []
+    for product_id, item in latest.items():
+        if existing[product_id] is None:
+            inserts.append({
+                "price": item.price,
+                "quantity": item.quantity,
+                "product_id": product_id,
+                "seller_id": seller_id
+            })
+        else:
+            updates.append({"id": existing[product_id], "price": item.price, "quantity": item.quantity})
+            stock_rows.append((existing[product_id], seller_id, product_id, item.price, item.quantity))
+
+    if inserts:
+        # The new ids come back for the seller's feed
+        result = await db.execute(insert(models.SellerProduct).returning(*STOCK_COLUMNS), inserts)
+        stock_rows.extend(result.all())
+    if updates:
+        # ORM bulk UPDATE by primary key, sent as a single executemany
+        await db.execute(update(models.SellerProduct), updates)
+    await refresh_offer_summaries(db, latest)
+    stock_changed(db, stock_rows)
+    await db.commit()
+    invalidate_catalog(latest)
+    return len(inserts), len(updates), errors
 
 async def get_seller_inventory(db: AsyncSession, seller_id: int):
     query = (
         select(models.SellerProduct)
-        .options(selectinload(models.SellerProduct.product))
+        .options(
+            selectinload(models.SellerProduct.product),
+            selectinload(models.SellerProduct.seller)
+        )
         .filter(models.SellerProduct.seller_id == seller_id)
     )
     result = await db.execute(query)
@@ -146,87 +358,945 @@ async def get_product(db: AsyncSession, product_id: int):
     return result.scalars().first()
 
 # Order CRUD Functions
+# What the sellers' feeds report of a stock change
+STOCK_COLUMNS = (
+    models.SellerProduct.id,
+    models.SellerProduct.seller_id,
+    models.SellerProduct.product_id,
+    models.SellerProduct.price,
+    models.SellerProduct.quantity,
+)
+
+def stock_changed(db: AsyncSession, rows):
+    for seller_product_id, seller_id, product_id, price, quantity in rows:
+        events.stock_changed(db, seller_id, seller_product_id, product_id, price, quantity)
+
+async def decrement_stock(db: AsyncSession, quantities: dict[int, int]) -> bool:
+    """
+    Take `quantities` (seller_product_id -> units) off seller stock in one
+    conditional UPDATE. Returns False, leaving stock untouched, when any item
+    no longer has enough units, so concurrent orders can never oversell.
+    """
+    if not quantities:
+        return True
+
+    amount = case(quantities, value=models.SellerProduct.id)
+    result = await db.execute(
+        update(models.SellerProduct)
+        .where(
+            models.SellerProduct.id.in_(quantities),
+            models.SellerProduct.quantity >= amount
+        )
+        .values(quantity=models.SellerProduct.quantity - amount)
+        .returning(*STOCK_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    rows = result.all()
+    # SellerProduct objects already in the session show the stock left after
+    # this update, without a reload
+    for seller_product_id, _, _, _, quantity in rows:
+        seller_product = db.identity_map.get(identity_key(models.SellerProduct, seller_product_id))
+        if seller_product is not None:
+            set_committed_value(seller_product, "quantity", quantity)
+    if len(rows) != len(quantities):
+        return False
+    stock_changed(db, rows)
+    return True
+
 async def create_order(db: AsyncSession, order_data: schemas.OrderCreate, buyer_id: int):
+    try:
+        new_order = await add_order(db, order_data, buyer_id)
+    except HTTPException:
+        await db.rollback()
+        raise
+    await db.commit()
+    invalidate_catalog([item.product_item.product_id for item in new_order.items])
+    return new_order
+
+async def add_order(db: AsyncSession, order_data: schemas.OrderCreate, buyer_id: int):
+    """
+    Validate an order, take its stock and add it to the session. The caller
+    commits, or rolls back when this raises HTTPException.
+    """
     total_price = 0
     items_to_process = []
-    
+
+    requested = {}
+    for item_data in order_data.items:
+        requested[item_data.seller_product_id] = requested.get(item_data.seller_product_id, 0) + item_data.quantity
+
+    # All line items in one query instead of one get per item, along with what
+    # the response shows of them. Always read fresh, an earlier order of the
+    # same intake batch may have rolled back stock this session had seen.
+    result = await db.execute(
+        select(models.SellerProduct)
+        .options(joinedload(models.SellerProduct.product), joinedload(models.SellerProduct.seller))
+        .filter(models.SellerProduct.id.in_(requested))
+        .execution_options(populate_existing=True)
+    )
+    seller_products = {seller_product.id: seller_product for seller_product in result.scalars()}
+
     for item_data in order_data.items:
-        seller_product = await db.get(models.SellerProduct, item_data.seller_product_id)
+        seller_product = seller_products.get(item_data.seller_product_id)
 
         if not seller_product or seller_product.seller_id != order_data.seller_id:
             raise HTTPException(status_code=404, detail=f"Product item with id {item_data.seller_product_id} not found for this seller.")
 
-        if seller_product.quantity < item_data.quantity:
-            raise HTTPException(status_code=400, detail=f"Not enough stock for product id {seller_product.product_id}. Available: {seller_product.quantity}, Requested: {item_data.quantity}")
+        if seller_product.quantity < requested[seller_product.id]:
+            raise HTTPException(status_code=400, detail=f"Not enough stock for product id {seller_product.product_id}. Available: {seller_product.quantity}, Requested: {requested[seller_product.id]}")
 
         total_price += seller_product.price * item_data.quantity
         items_to_process.append((seller_product, item_data.quantity))
 
-    # Create the Order object
-    new_order = models.Order(
-        buyer_id=buyer_id,
-        seller_id=order_data.seller_id,
-        total_price=total_price
-    )
+    # The check above reads a snapshot, the conditional update is what actually
+    # guards against another order taking the same stock in the meantime
+    if not await decrement_stock(db, requested):
+        raise HTTPException(status_code=409, detail="Not enough stock for one or more items, please review your order.")
+
+    # Seller stock is part of the product responses
+    await refresh_offer_summaries(db, [product.product_id for product, _ in items_to_process])
+    return await place_order(db, buyer_id, order_data.seller_id, items_to_process)
+
+async def place_order(db: AsyncSession, buyer_id: int, seller_id: int, lines):
+    """
+    Add an order for `lines`, (SellerProduct, quantity) pairs whose stock has
+    already been taken, and count it in the sales rollups. The caller commits.
+    """
+    new_order = build_order(buyer_id, seller_id, lines)
     db.add(new_order)
+    # The ids are part of the seller's feed event and the snapshot
     await db.flush()
+    await add_order_snapshots(db, [new_order])
+    events.order_created(db, new_order)
+    await record_sales(
+        db,
+        seller_id=seller_id,
+        day=sales_day(new_order.created_at),
+        status=new_order.status,
+        lines=order_sales_lines(lines)
+    )
+    return new_order
+
+def build_order(buyer_id: int, seller_id: int, lines):
+    # Create the Order object along with its OrderItem objects
+    return models.Order(
+        buyer_id=buyer_id,
+        seller_id=seller_id,
+        total_price=sum(product.price * quantity_ordered for product, quantity_ordered in lines),
+        status="PENDING",
+        created_at=datetime.now(timezone.utc),
+        items=[
+            models.OrderItem(
+                product_item=product,
+                quantity=quantity_ordered,
+                price_at_purchase=product.price
+            )
+            for product, quantity_ordered in lines
+        ]
+    )
+
+def order_sales_lines(lines):
+    return [
+        (product.product_id, quantity_ordered, product.price * quantity_ordered)
+        for product, quantity_ordered in lines
+    ]
+
+async def checkout_cart(db: AsyncSession, cart: schemas.CartCheckout, buyer_id: int):
+    """
+    Place one order per seller for a cart spanning any number of sellers, all
+    in one transaction. The number of statements doesn't grow with the number
+    of items or sellers: line items are read in one query, stock is taken in
+    one UPDATE, and the orders, their items and the rollups are each written
+    with one multi-row INSERT.
+    """
+    requested = held_quantities((item.seller_product_id, item.quantity) for item in cart.items)
+    result = await db.execute(
+        select(models.SellerProduct)
+        .options(joinedload(models.SellerProduct.product), joinedload(models.SellerProduct.seller))
+        .filter(models.SellerProduct.id.in_(requested))
+    )
+    seller_products = {seller_product.id: seller_product for seller_product in result.scalars()}
+
+    # Repeated items of the cart become one line with the summed quantity
+    per_seller = {}
+    for seller_product_id, quantity in requested.items():
+        seller_product = seller_products.get(seller_product_id)
+        if seller_product is None:
+            raise HTTPException(status_code=404, detail=f"Product item with id {seller_product_id} not found.")
+        if seller_product.quantity < quantity:
+            raise HTTPException(status_code=400, detail=f"Not enough stock for product id {seller_product.product_id}. Available: {seller_product.quantity}, Requested: {quantity}")
+        per_seller.setdefault(seller_product.seller_id, []).append((seller_product, quantity))
+
+    if not await decrement_stock(db, requested):
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Not enough stock for one or more items, please review your cart.")
+    await refresh_offer_summaries(db, [seller_product.product_id for seller_product in seller_products.values()])
+
+    # The orders are built as usual but never added to the session: the unit of
+    # work would insert them one row at a time to read back each id. A cart has
+    # one order per seller and one item per seller product, so the ids returned
+    # by each multi-row INSERT are matched up by those columns.
+    orders = [build_order(buyer_id, seller_id, lines) for seller_id, lines in sorted(per_seller.items())]
+    result = await db.execute(
+        insert(models.Order)
+        .values([
+            {
+                "buyer_id": order.buyer_id,
+                "seller_id": order.seller_id,
+                "total_price": order.total_price,
+                "status": order.status,
+                "created_at": order.created_at,
+            }
+            for order in orders
+        ])
+        .returning(models.Order.seller_id, models.Order.id)
+    )
+    order_ids = dict(result.all())
+    items = []
+    for order in orders:
+        order.id = order_ids[order.seller_id]
+        for item in order.items:
+            item.order_id = order.id
+            item.seller_product_id = item.product_item.id
+            items.append(item)
+    result = await db.execute(
+        insert(models.OrderItem)
+        .values([
+            {
+                "order_id": item.order_id,
+                "seller_product_id": item.seller_product_id,
+                "quantity": item.quantity,
+                "price_at_purchase": item.price_at_purchase,
+            }
+            for item in items
+        ])
+        .returning(models.OrderItem.seller_product_id, models.OrderItem.id)
+    )
+    item_ids = dict(result.all())
+    for item in items:
+        item.id = item_ids[item.seller_product_id]
+    await add_order_snapshots(db, orders)
+    for order in orders:
+        events.order_created(db, order)
+
+    daily_rows, product_rows = [], []
+    for order, (seller_id, lines) in zip(orders, sorted(per_seller.items())):
+        daily, products = sales_rows(seller_id, sales_day(order.created_at), order.status, order_sales_lines(lines))
+        daily_rows.append(daily)
+        product_rows.extend(products)
+    # One row per seller, and per seller and product, so no row conflicts
+    # with another row of the same statement
+    await increment_rollup(db, models.SellerDailySales, daily_rows)
+    await increment_rollup(db, models.SellerProductDailySales, product_rows)
+
+    await db.commit()
+    invalidate_catalog([seller_product.product_id for seller_product in seller_products.values()])
+    return orders
+
+async def restock(db: AsyncSession, quantities: dict[int, int]):
+    """
+    Put `quantities` (seller_product_id -> units) back into seller stock in one
+    UPDATE and refresh the offer summaries. Returns the affected product ids.
+    """
+    if not quantities:
+        return []
+
+    amount = case(quantities, value=models.SellerProduct.id)
+    result = await db.execute(
+        update(models.SellerProduct)
+        .where(models.SellerProduct.id.in_(quantities))
+        .values(quantity=models.SellerProduct.quantity + amount)
+        .returning(*STOCK_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )
+    rows = result.all()
+    stock_changed(db, rows)
+    product_ids = [product_id for _, _, product_id, _, _ in rows]
+    await refresh_offer_summaries(db, product_ids)
+    return product_ids
 
-    order_id_for_query = new_order.id
+def held_quantities(rows):
+    quantities = {}
+    for seller_product_id, quantity in rows:
+        quantities[seller_product_id] = quantities.get(seller_product_id, 0) + quantity
+    return quantities
 
-    # Create the OrderItem objects and update inventory
-    for product, quantity_ordered in items_to_process:
-        order_item = models.OrderItem(
-            order_id=new_order.id,
-            seller_product_id=product.id,
-            quantity=quantity_ordered,
-            price_at_purchase=product.price
+# Reservation CRUD Functions
+async def reserve_stock(db: AsyncSession, reservation: schemas.ReservationCreate, buyer_id: int):
+    """
+    Take stock off a seller product and hold it for the buyer for
+    RESERVATION_TTL_SECONDS. This is the only step of a reserved purchase that
+    contends on the SellerProduct row, checkout just consumes the hold. A buyer
+    holds at most RESERVATION_MAX_UNITS_PER_BUYER units of a seller product.
+    """
+    max_units = settings.RESERVATION_MAX_UNITS_PER_BUYER
+    if reservation.quantity > max_units:
+        raise HTTPException(status_code=409, detail=f"At most {max_units} units of an item can be held.")
+
+    seller_product = await db.get(models.SellerProduct, reservation.seller_product_id)
+    if seller_product is None:
+        raise HTTPException(status_code=404, detail=f"Product item with id {reservation.seller_product_id} not found.")
+    product_id = seller_product.product_id
+
+    # Sold out holds are turned away from the snapshot without taking the
+    # write lock, the conditional update below settles the rest
+    if seller_product.quantity < reservation.quantity or not await decrement_stock(
+        db, {reservation.seller_product_id: reservation.quantity}
+    ):
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Not enough stock left to reserve.")
+
+    # Counted after the conditional update, which locks the seller product row
+    # until commit, so concurrent holds of the buyer see each other's units
+    now = datetime.now(timezone.utc)
+    held = await db.scalar(
+        select(func.coalesce(func.sum(models.Reservation.quantity), 0))
+        .filter(
+            models.Reservation.buyer_id == buyer_id,
+            models.Reservation.seller_product_id == reservation.seller_product_id,
+            models.Reservation.expires_at > now
         )
-        db.add(order_item)
-        product.quantity -= quantity_ordered
+    )
+    if held + reservation.quantity > max_units:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail=f"At most {max_units} units of an item can be held, {held} already are.")
 
+    db_reservation = models.Reservation(
+        buyer_id=buyer_id,
+        seller_product_id=reservation.seller_product_id,
+        quantity=reservation.quantity,
+        expires_at=now + timedelta(seconds=settings.RESERVATION_TTL_SECONDS)
+    )
+    db.add(db_reservation)
+    await refresh_offer_summaries(db, [product_id])
     await db.commit()
+    invalidate_catalog([product_id])
+    return db_reservation
 
-    query = (
-        select(models.Order)
-        .options(
-            selectinload(models.Order.items).options(
-                selectinload(models.OrderItem.product_item).options(
-                    selectinload(models.SellerProduct.product),
-                    selectinload(models.SellerProduct.seller)
+async def release_reservation(db: AsyncSession, reservation_id: int, buyer_id: int):
+    result = await db.execute(
+        delete(models.Reservation)
+        .where(models.Reservation.id == reservation_id, models.Reservation.buyer_id == buyer_id)
+        .returning(models.Reservation.seller_product_id, models.Reservation.quantity)
+    )
+    rows = result.all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="Reservation not found")
+
+    product_ids = await restock(db, held_quantities(rows))
+    await db.commit()
+    invalidate_catalog(product_ids)
+
+async def release_expired_reservations(db: AsyncSession, limit: int = 500) -> int:
+    """
+    Put the stock of up to `limit` expired holds back and delete them.
+    Returns the number of holds released.
+    """
+    expired = (
+        select(models.Reservation.id)
+        .filter(models.Reservation.expires_at <= datetime.now(timezone.utc))
+        .order_by(models.Reservation.expires_at)
+        .limit(limit)
+        # Sweepers of other workers take the next batch instead of waiting
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(
+        delete(models.Reservation)
+        .where(models.Reservation.id.in_(expired))
+        .returning(models.Reservation.seller_product_id, models.Reservation.quantity)
+    )
+    rows = result.all()
+    product_ids = await restock(db, held_quantities(rows))
+    await db.commit()
+    invalidate_catalog(product_ids)
+    return len(rows)
+
+async def checkout_reservations(db: AsyncSession, checkout: schemas.ReservationCheckout, buyer_id: int):
+    """
+    Turn the buyer's holds into one order. The stock was taken when the holds
+    were placed, so this never touches SellerProduct.quantity.
+    """
+    reservation_ids = set(checkout.reservation_ids)
+    # Deleting the holds claims them, a concurrent checkout or sweep of the same
+    # holds gets nothing back
+    result = await db.execute(
+        delete(models.Reservation)
+        .where(
+            models.Reservation.id.in_(reservation_ids),
+            models.Reservation.buyer_id == buyer_id,
+            models.Reservation.expires_at > datetime.now(timezone.utc)
+        )
+        .returning(models.Reservation.seller_product_id, models.Reservation.quantity)
+    )
+    rows = result.all()
+    if len(rows) != len(reservation_ids):
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="One or more reservations have expired or do not exist.")
+
+    held = held_quantities(rows)
+    result = await db.execute(
+        select(models.SellerProduct)
+        .options(joinedload(models.SellerProduct.product), joinedload(models.SellerProduct.seller))
+        .filter(models.SellerProduct.id.in_(held))
+        .order_by(models.SellerProduct.id)
+    )
+    seller_products = result.scalars().all()
+    seller_ids = {seller_product.seller_id for seller_product in seller_products}
+    if len(seller_ids) != 1:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Reserved items must come from a single seller.")
+
+    new_order = await place_order(
+        db, buyer_id, seller_ids.pop(), [(seller_product, held[seller_product.id]) for seller_product in seller_products]
+    )
+    await db.commit()
+    return new_order
+
+# Order snapshot Functions
+STATUS_KEY = b'"status":'
+
+def order_snapshot_row(order):
+    """
+    OrderSnapshot row of an order whose items, products and sellers are
+    loaded. The fields before the status are numbers, so the first "status"
+    key is the order's own. Written as the order is placed, so its offers show
+    the price paid and the stock left after the order.
+    """
+    body = dump_json(schemas.Order, order)
+    status_offset = body.index(STATUS_KEY) + len(STATUS_KEY)
+    status = dump_json(str, order.status)
+    return {
+        "order_id": order.id,
+        "status_offset": status_offset,
+        "body": body[:status_offset] + body[status_offset + len(status):],
+    }
+
+async def add_order_snapshots(db: AsyncSession, orders):
+    if orders:
+        await db.execute(insert(models.OrderSnapshot).values([order_snapshot_row(order) for order in orders]))
+
+def order_snapshot_query():
+    # Filters and order go on the orders table and its indexes, the snapshot
+    # is a primary key lookup. The outer join keeps orders placed by workers
+    # that predate snapshots.
+    return (
+        select(
+            models.Order.id,
+            models.Order.created_at,
+            models.Order.status,
+            models.OrderSnapshot.status_offset,
+            models.OrderSnapshot.body
+        )
+        .outerjoin(models.OrderSnapshot, models.OrderSnapshot.order_id == models.Order.id)
+    )
+
+async def render_orders(db: AsyncSession, rows):
+    """
+    schemas.Order JSON of each order_snapshot_query row. Orders without a
+    snapshot are loaded and serialized in full.
+    """
+    missing = [row.id for row in rows if row.body is None]
+    built = {}
+    if missing:
+        result = await db.execute(
+            select(models.Order)
+            .options(
+                selectinload(models.Order.items).options(
+                    selectinload(models.OrderItem.product_item).options(
+                        selectinload(models.SellerProduct.product),
+                        selectinload(models.SellerProduct.seller)
+                    )
                 )
             )
+            .filter(models.Order.id.in_(missing))
         )
-        .filter(models.Order.id == order_id_for_query)
+        built = {order.id: dump_json(schemas.Order, order) for order in result.scalars()}
+    return [
+        built[row.id] if row.body is None
+        else row.body[:row.status_offset] + dump_json(str, row.status) + row.body[row.status_offset:]
+        for row in rows
+    ]
+
+async def get_order_json(db: AsyncSession, order_id: int):
+    result = await db.execute(order_snapshot_query().filter(models.Order.id == order_id))
+    rows = result.all()
+    if not rows:
+        return None
+    return (await render_orders(db, rows))[0]
+
+async def get_user_orders(db: AsyncSession, user_id: int):
+    """
+    (purchase orders, sale orders) JSON of a user, in id order.
+    """
+    result = await db.execute(
+        order_snapshot_query()
+        .add_columns(models.Order.buyer_id)
+        .filter(or_(models.Order.buyer_id == user_id, models.Order.seller_id == user_id))
+        .order_by(models.Order.id)
     )
+    rows = result.all()
+    bodies = await render_orders(db, rows)
+    purchases = [body for row, body in zip(rows, bodies) if row.buyer_id == user_id]
+    sales = [body for row, body in zip(rows, bodies) if row.buyer_id != user_id]
+    return purchases, sales
+
+# Order intake CRUD Functions
+async def get_order_intake(db: AsyncSession, buyer_id: int, intake_id: int | None = None, idempotency_key: str | None = None):
+    query = select(models.OrderIntake).filter(models.OrderIntake.buyer_id == buyer_id)
+    if intake_id is not None:
+        query = query.filter(models.OrderIntake.id == intake_id)
+    if idempotency_key is not None:
+        query = query.filter(models.OrderIntake.idempotency_key == idempotency_key)
     result = await db.execute(query)
     return result.scalars().first()
 
+async def enqueue_order(db: AsyncSession, order_data: schemas.OrderCreate, buyer_id: int, idempotency_key: str):
+    """
+    Queue an order for the intake worker. A retry with the same key returns
+    the entry of the first request instead of queueing the order again.
+    """
+    payload = order_data.model_dump()
+    entry = await get_order_intake(db, buyer_id, idempotency_key=idempotency_key)
+    if entry is None:
+        entry = models.OrderIntake(
+            buyer_id=buyer_id,
+            idempotency_key=idempotency_key,
+            payload=payload,
+            status="QUEUED"
+        )
+        db.add(entry)
+        try:
+            await db.commit()
+            return entry
+        except IntegrityError:
+            # A concurrent retry with the same key got in first
+            await db.rollback()
+            entry = await get_order_intake(db, buyer_id, idempotency_key=idempotency_key)
+
+    if entry.payload != payload:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different order.")
+    return entry
+
+async def process_order_intake(db: AsyncSession, limit: int = 50) -> int:
+    """
+    Place up to `limit` queued orders in one transaction, each in its own
+    savepoint so a rejected order doesn't undo the others. Returns the number
+    of requests processed.
+    """
+    claimed = (
+        select(models.OrderIntake.id)
+        .filter(models.OrderIntake.status == "QUEUED")
+        .order_by(models.OrderIntake.id)
+        .limit(limit)
+        # Workers of other processes take the next batch instead of waiting
+        .with_for_update(skip_locked=True)
+    )
+    # Claiming with an UPDATE also opens the write transaction on SQLite, the
+    # savepoints below only nest inside one. Nobody sees PROCESSING, the batch
+    # commits with its final status or rolls back to QUEUED.
+    result = await db.execute(
+        update(models.OrderIntake)
+        .where(models.OrderIntake.id.in_(claimed))
+        .values(status="PROCESSING")
+        .returning(models.OrderIntake)
+        .execution_options(synchronize_session=False)
+    )
+    entries = sorted(result.scalars().all(), key=lambda entry: entry.id)
+
+    product_ids = set()
+    for entry in entries:
+        try:
+            async with db.begin_nested():
+                new_order = await add_order(db, schemas.OrderCreate.model_validate(entry.payload), entry.buyer_id)
+                await db.flush()
+        except HTTPException as error:
+            entry.status = "FAILED"
+            entry.status_code = error.status_code
+            entry.detail = error.detail
+        except Exception as error:
+            # The savepoint rolled back, the rest of the batch goes on. Lock
+            # conflicts and lost connections are retried in a later batch, up to
+            # a limit, anything else fails the request like a 500 would.
+            entry.attempts += 1
+            if is_transient(error) and entry.attempts < settings.ORDER_INTAKE_MAX_ATTEMPTS:
+                logger.warning("Order intake %s failed, retrying: %s", entry.id, error)
+                entry.status = "QUEUED"
+                continue
+            logger.exception("Order intake %s failed", entry.id)
+            entry.status = "FAILED"
+            entry.status_code = 500
+            entry.detail = "Internal Server Error"
+        else:
+            entry.status = "DONE"
+            entry.status_code = 200
+            entry.order_id = new_order.id
+            product_ids.update(item.product_item.product_id for item in new_order.items)
+        entry.processed_at = datetime.now(timezone.utc)
+
+    await db.commit()
+    invalidate_catalog(product_ids)
+    return len(entries)
+
+# Postgres serialization failure and deadlock
+TRANSIENT_SQLSTATES = {"40001", "40P01"}
+
+def is_transient(error: Exception) -> bool:
+    if not isinstance(error, DBAPIError):
+        return False
+    return (
+        isinstance(error, OperationalError)
+        or error.connection_invalidated
+        or getattr(error.orig, "sqlstate", None) in TRANSIENT_SQLSTATES
+    )
+
+# Status changes allowed, by current status. Orders leave PENDING once, so a
+# cancelled order is only ever restocked once.
+ORDER_STATUS_TRANSITIONS = {
+    "PENDING": {"CONFIRMED", "CANCELED"},
+}
+
 async def update_order_status(db: AsyncSession, order_id: int, seller_id: int, new_status: str):
-    order = await db.get(models.Order, order_id)
+    """
+    Move one of the seller's orders to `new_status`, if its current status
+    allows it. Setting the status it already has changes nothing. Cancelled
+    orders put their stock back.
+    """
+    # Locked so concurrent status changes move the order between rollup rows one
+    # after the other. The items are loaded for the rollups and the response.
+    result = await db.execute(
+        select(models.Order)
+        .options(
+            selectinload(models.Order.items).options(
+                joinedload(models.OrderItem.product_item).options(
+                    joinedload(models.SellerProduct.product),
+                    joinedload(models.SellerProduct.seller)
+                )
+            )
+        )
+        .filter(models.Order.id == order_id)
+        .with_for_update(of=models.Order)
+    )
+    order = result.scalars().first()
 
     if not order or order.seller_id != seller_id:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    order.status = new_status
+    if order.status == new_status:
+        # Ends the transaction without expiring the order, the response is
+        # built from it
+        await db.commit()
+        return order
+
+    previous_status = order.status
+    if new_status not in ORDER_STATUS_TRANSITIONS.get(previous_status, ()):
+        await db.rollback()
+        raise HTTPException(status_code=409, detail=f"Cannot change status from {previous_status} to {new_status}")
+
+    # SQLite doesn't lock rows on select, repeating the status check in the
+    # WHERE clause keeps two concurrent cancels from both restocking
+    result = await db.execute(
+        update(models.Order)
+        .where(models.Order.id == order.id, models.Order.status == previous_status)
+        .values(status=new_status)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Order status changed concurrently")
+    set_committed_value(order, "status", new_status)
+
+    lines = [
+        (item.product_item.product_id, item.quantity, item.quantity * item.price_at_purchase)
+        for item in order.items
+    ]
+    day = sales_day(order.created_at)
+    await record_sales(db, seller_id=seller_id, day=day, status=previous_status, lines=lines, sign=-1)
+    await record_sales(db, seller_id=seller_id, day=day, status=new_status, lines=lines)
+    events.order_status_changed(db, seller_id, order.id, previous_status, new_status)
+
+    product_ids = []
+    if new_status == "CANCELED":
+        product_ids = await restock(db, held_quantities((item.seller_product_id, item.quantity) for item in order.items))
+
     await db.commit()
-    await db.refresh(order)
+    invalidate_catalog(product_ids)
     return order
 
-async def get_orders_for_seller(db: AsyncSession, seller_id: int):
+async def bulk_update_order_status(db: AsyncSession, order_ids: list[int], seller_id: int, new_status: str):
+    """
+    Move the seller's orders in `order_ids` to `new_status` with one UPDATE,
+    for those whose current status allows it. Cancelled orders put their stock
+    back. Returns the ids that changed and (order_id, reason) for the rest.
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    # Locked like a single status change, so the rollups are moved from the
+    # status each order really had
+    result = await db.execute(
+        select(models.Order.id, models.Order.status)
+        .filter(models.Order.id.in_(order_ids), models.Order.seller_id == seller_id)
+        .order_by(models.Order.id)
+        .with_for_update()
+    )
+    current = dict(result.all())
+
+    rejected, allowed = [], {}
+    for order_id in order_ids:
+        if order_id not in current:
+            rejected.append((order_id, "Order not found"))
+        elif new_status not in ORDER_STATUS_TRANSITIONS.get(current[order_id], ()):
+            rejected.append((order_id, f"Cannot change status from {current[order_id]} to {new_status}"))
+        else:
+            allowed[order_id] = current[order_id]
+
+    if not allowed:
+        await db.rollback()
+        return [], rejected
+
+    # SQLite doesn't lock rows on select, repeating the status check in the
+    # WHERE clause keeps a concurrent change from being overwritten there
+    result = await db.execute(
+        update(models.Order)
+        .where(
+            models.Order.id.in_(allowed),
+            models.Order.status == case(allowed, value=models.Order.id)
+        )
+        .values(status=new_status)
+        .returning(models.Order.id, models.Order.created_at)
+        .execution_options(synchronize_session=False)
+    )
+    days = {order_id: sales_day(created_at) for order_id, created_at in result.all()}
+    for order_id in days:
+        events.order_status_changed(db, seller_id, order_id, allowed[order_id], new_status)
+    for order_id in allowed:
+        if order_id not in days:
+            rejected.append((order_id, "Order status changed concurrently"))
+
+    product_ids = []
+    if days:
+        result = await db.execute(
+            select(
+                models.OrderItem.order_id,
+                models.OrderItem.seller_product_id,
+                models.SellerProduct.product_id,
+                models.OrderItem.quantity,
+                models.OrderItem.price_at_purchase
+            )
+            .join(models.SellerProduct, models.OrderItem.product_item)
+            .filter(models.OrderItem.order_id.in_(days))
+        )
+        items = result.all()
+
+        lines = {order_id: [] for order_id in days}
+        for order_id, _, product_id, quantity, price in items:
+            lines[order_id].append((product_id, quantity, quantity * price))
+        daily_rows, product_rows = [], []
+        for order_id, order_lines in lines.items():
+            for status, sign in ((allowed[order_id], -1), (new_status, 1)):
+                daily, products = sales_rows(seller_id, days[order_id], status, order_lines, sign)
+                daily_rows.append(daily)
+                product_rows.extend(products)
+        await increment_rollup(db, models.SellerDailySales, daily_rows)
+        if product_rows:
+            await increment_rollup(db, models.SellerProductDailySales, product_rows)
+
+        if new_status == "CANCELED":
+            product_ids = await restock(db, held_quantities((seller_product_id, quantity) for _, seller_product_id, _, quantity, _ in items))
+
+    await db.commit()
+    if product_ids:
+        invalidate_catalog(product_ids)
+    return list(days), rejected
+
+def as_utc(value: datetime) -> datetime:
+    # Postgres hands back aware datetimes, SQLite naive ones that are already
+    # UTC. Naive input from clients is taken as UTC too.
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def sales_day(created_at: datetime) -> date:
+    return as_utc(created_at).date()
+
+async def record_sales(db: AsyncSession, seller_id: int, day: date, status: str, lines, sign: int = 1):
+    """
+    Add one order to the seller's sales rollups, or take it out again with
+    sign=-1. `lines` are (product_id, quantity, revenue) tuples of its items.
+    """
+    daily, products = sales_rows(seller_id, day, status, lines, sign)
+    await increment_rollup(db, models.SellerDailySales, [daily])
+    if products:
+        await increment_rollup(db, models.SellerProductDailySales, products)
+
+def sales_rows(seller_id: int, day: date, status: str, lines, sign: int = 1):
+    """
+    The SellerDailySales row and SellerProductDailySales rows that count one
+    order in the rollups.
+    """
+    per_product = {}
+    for product_id, quantity, revenue in lines:
+        units, amount = per_product.get(product_id, (0, 0.0))
+        per_product[product_id] = (units + quantity, amount + revenue)
+
+    key = {"seller_id": seller_id, "day": day, "status": status}
+    daily = {
+        **key,
+        "order_count": sign,
+        "units_sold": sign * sum(units for units, _ in per_product.values()),
+        "revenue": sign * sum(amount for _, amount in per_product.values()),
+    }
+    products = [
+        {**key, "product_id": product_id, "order_count": sign, "units_sold": sign * units, "revenue": sign * amount}
+        for product_id, (units, amount) in per_product.items()
+    ]
+    return daily, products
+
+async def increment_rollup(db: AsyncSession, model, rows):
+    # PostgreSQL refuses to update the same row twice in one statement, so rows
+    # for the same key are added up first
+    key_columns = [column.name for column in model.__table__.primary_key]
+    merged = {}
+    for row in rows:
+        key = tuple(row[column] for column in key_columns)
+        if key in merged:
+            for column in ("order_count", "units_sold", "revenue"):
+                merged[key][column] += row[column]
+        else:
+            merged[key] = dict(row)
+
+    statement = upsert(db, model).values(list(merged.values()))
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={
+            column: getattr(model, column) + statement.excluded[column]
+            for column in ("order_count", "units_sold", "revenue")
+        }
+    ))
+
+def period_start(day: date, bucket: str) -> date:
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+async def get_seller_analytics(
+    db: AsyncSession,
+    seller_id: int,
+    bucket: str = "day",
+    start: date | None = None,
+    end: date | None = None
+):
+    """
+    Sales of a seller by status, by period and by product and period, summed
+    from the daily rollups. Periods are UTC days, ISO weeks or calendar months.
+    """
+    def daily_rows(model):
+        query = select(model).filter(model.seller_id == seller_id, model.order_count != 0)
+        if start is not None:
+            query = query.filter(model.day >= start)
+        if end is not None:
+            query = query.filter(model.day <= end)
+        return db.execute(query)
+
+    totals, periods, products = {}, {}, {}
+    for row in (await daily_rows(models.SellerDailySales)).scalars():
+        period = period_start(row.day, bucket)
+        add_sales(totals, (row.status,), row)
+        add_sales(periods, (period, row.status), row)
+    for row in (await daily_rows(models.SellerProductDailySales)).scalars():
+        add_sales(products, (period_start(row.day, bucket), row.product_id, row.status), row)
+
+    return {
+        "bucket": bucket,
+        "totals": [{"status": status, **figures} for (status,), figures in sorted(totals.items())],
+        "periods": [
+            {"period": period, "status": status, **figures}
+            for (period, status), figures in sorted(periods.items())
+        ],
+        "products": [
+            {"period": period, "product_id": product_id, "status": status, **figures}
+            for (period, product_id, status), figures in sorted(products.items())
+        ],
+    }
+
+def add_sales(groups: dict, key: tuple, row):
+    figures = groups.setdefault(key, {"order_count": 0, "units_sold": 0, "revenue": 0.0})
+    figures["order_count"] += row.order_count
+    figures["units_sold"] += row.units_sold
+    # Rollups accumulate float increments, report whole cents
+    figures["revenue"] = round(figures["revenue"] + row.revenue, 2)
+
+async def get_orders_for_seller(db: AsyncSession, seller_id: int, **filters):
+    return await get_order_history(db, seller_id=seller_id, **filters)
+
+async def get_orders_for_buyer(db: AsyncSession, buyer_id: int, **filters):
+    return await get_order_history(db, buyer_id=buyer_id, **filters)
+
+async def get_order_history(
+    db: AsyncSession,
+    seller_id: int | None = None,
+    buyer_id: int | None = None,
+    statuses: list[str] | None = None,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+    after: tuple[datetime, int] | None = None,
+    limit: int = 100
+):
+    """
+    One page of a seller's or buyer's orders, oldest first, as (id,
+    created_at, JSON) tuples. `after` is the (created_at, id) of the last
+    order of the previous page. Every filter combination seeks on one of the
+    (user, [status,] created_at, id) indexes.
+    """
     query = (
-        select(models.Order)
-        .options(selectinload(models.Order.items))
-        .filter(models.Order.seller_id == seller_id)
-        .order_by(models.Order.id.asc())
+        order_snapshot_query()
+        .order_by(models.Order.created_at.asc(), models.Order.id.asc())
+        .limit(limit)
     )
+    if seller_id is not None:
+        query = query.filter(models.Order.seller_id == seller_id)
+    if buyer_id is not None:
+        query = query.filter(models.Order.buyer_id == buyer_id)
+    if statuses:
+        query = query.filter(models.Order.status.in_(statuses))
+    if created_after is not None:
+        query = query.filter(models.Order.created_at >= as_utc(created_after))
+    if created_before is not None:
+        query = query.filter(models.Order.created_at < as_utc(created_before))
+    if after is not None:
+        created_at, order_id = as_utc(after[0]), after[1]
+        query = query.filter(or_(
+            models.Order.created_at > created_at,
+            and_(models.Order.created_at == created_at, models.Order.id > order_id)
+        ))
     result = await db.execute(query)
-    return result.scalars().all()
+    rows = result.all()
+    bodies = await render_orders(db, rows)
+    return [(row.id, row.created_at, body) for row, body in zip(rows, bodies)]
 
-async def get_orders_for_buyer(db: AsyncSession, buyer_id: int):
+async def iter_orders(
+    db: AsyncSession,
+    seller_id: int | None = None,
+    buyer_id: int | None = None,
+    after_id: int | None = None,
+    batch_size: int = 500
+):
+    """
+    Yield the JSON of orders in id order, `batch_size` at a time, from a
+    server-side cursor so the whole history is never held in memory at once.
+    """
     query = (
-        select(models.Order)
-        .options(selectinload(models.Order.items))
-        .filter(models.Order.buyer_id == buyer_id)
+        order_snapshot_query()
+        .order_by(models.Order.id.asc())
+        .execution_options(yield_per=batch_size)
     )
-    result = await db.execute(query)
-    return result.scalars().all()
\ No newline at end of file
+    if seller_id is not None:
+        query = query.filter(models.Order.seller_id == seller_id)
+    if buyer_id is not None:
+        query = query.filter(models.Order.buyer_id == buyer_id)
+    if after_id is not None:
+        query = query.filter(models.Order.id > after_id)
+
+    result = await db.stream(query)
+    async for batch in result.partitions():
+        yield await render_orders(db, batch)
@@ -1,5 +1,9 @@
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -7,24 +11,147 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
+    PRINCIPAL_CACHE_SIZE: int = 1024
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 60
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_QUEUE_SIZE: int = 64
+    CATALOG_CACHE_SIZE: int = 512
+    CATALOG_CACHE_TTL_SECONDS: int = 30
+    BULK_CHUNK_SIZE: int = 1000
+    BULK_MAX_LINE_BYTES: int = 65536
+    EXPORT_BATCH_SIZE: int = 500
+    # Stock holds, see crud.reserve_stock and reservations.py
+    RESERVATION_TTL_SECONDS: int = 120
+    # Units one buyer may hold of a seller product at once, unexpired holds
+    # count, so a single buyer can't keep a drop's stock by renewing holds
+    RESERVATION_MAX_UNITS_PER_BUYER: int = 10
+    RESERVATION_SWEEP_INTERVAL_SECONDS: float = 5.0
+    RESERVATION_SWEEP_BATCH_SIZE: int = 500
+    # Queued orders, see crud.process_order_intake and intake.py
+    ORDER_INTAKE_BATCH_SIZE: int = 50
+    ORDER_INTAKE_POLL_INTERVAL_SECONDS: float = 1.0
+    ORDER_INTAKE_MAX_ATTEMPTS: int = 3
+    # Memory-mapped catalog shared by the workers of a host, see snapshot.py.
+    # Disabled unless a path is set.
+    CATALOG_SNAPSHOT_PATH: str | None = None
+    CATALOG_SNAPSHOT_MIN_INTERVAL_SECONDS: float = 1.0
+    CATALOG_SNAPSHOT_CHECK_INTERVAL_SECONDS: float = 0.5
+    # Seller change feed, see events.py. Events kept per seller for resuming,
+    # sellers whose events are kept, and events a stream may fall behind
+    # before it is dropped.
+    EVENT_FEED_BUFFER_SIZE: int = 256
+    EVENT_FEED_BUFFERED_SELLERS: int = 1000
+    EVENT_FEED_QUEUE_SIZE: int = 100
+    EVENT_FEED_HEARTBEAT_SECONDS: float = 15.0
+    EVENT_FEED_RETRY_MS: int = 3000
+    # Run migrations when a worker starts, for local development only
+    AUTO_MIGRATE: bool = False
+
+    # Connection pool, per gunicorn worker
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    # SQLAlchemy compiled statement cache, and asyncpg's prepared statement cache
+    DB_QUERY_CACHE_SIZE: int = 500
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 100
+
+    # PRAGMAs applied to every new SQLite connection when the profile is enabled
+    SQLITE_PERFORMANCE_MODE: bool = True
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_CACHE_SIZE_KB: int = 65536
+    SQLITE_MMAP_SIZE: int = 268435456
 
     class Config:
         env_file = ".env"
 
 settings = Settings()
 
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that also records how long checkouts wait for a free connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
 database_url = settings.DATABASE_URL
 connect_args = {}
+is_sqlite = database_url.startswith("sqlite")
 
-if database_url.startswith("sqlite"):
+if is_sqlite:
     connect_args = {"check_same_thread": False}
 elif database_url.startswith("postgresql://"):
     database_url = database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
 
-engine = create_async_engine(database_url, connect_args=connect_args)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
+if database_url.startswith("postgresql+asyncpg://"):
+    database_url = make_url(database_url).update_query_dict(
+        {"prepared_statement_cache_size": str(settings.DB_PREPARED_STATEMENT_CACHE_SIZE)}
+    )
+
+engine_options = {"query_cache_size": settings.DB_QUERY_CACHE_SIZE}
+# In-memory SQLite shares one connection through a StaticPool and takes no pool sizing
+if make_url(database_url).database not in (None, "", ":memory:"):
+    engine_options.update(
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+
+engine = create_async_engine(database_url, connect_args=connect_args, **engine_options)
+
+if is_sqlite and settings.SQLITE_PERFORMANCE_MODE:
+    @event.listens_for(engine.sync_engine, "connect")
+    def apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        # Negative cache_size is in KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_SIZE_KB)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+        cursor.close()
+
+# Objects stay loaded after commit, so a write can build its response from what
+# it just inserted instead of reloading it
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine, class_=AsyncSession)
 Base = declarative_base()
 
+def pool_stats():
+    pool = engine.pool
+    if not isinstance(pool, InstrumentedQueuePool):
+        return {"pool": type(pool).__name__}
+    return {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "checkouts": pool.checkouts,
+        "wait_seconds_total": round(pool.wait_seconds_total, 6),
+        "wait_seconds_max": round(pool.wait_seconds_max, 6),
+    }
+
 async def get_db():
     async with SessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
@@ -1,10 +1,12 @@
-from fastapi import Depends, HTTPException, status
+from datetime import datetime
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from . import crud, schemas, security
 from .database import get_db, settings
+from .pagination import decode_cursor
 
 from . import schemas
 
@@ -27,12 +29,14 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user = await crud.get_user_by_email(db, email=email)
+    # Only the slim principal is needed for auth and role checks, the full
+    # user graph is loaded by the endpoints that actually return it
+    user = await crud.get_principal_by_email(db, email=email)
     if user is None:
         raise credentials_exception
     return user
 
-async def get_current_admin_user(current_user: schemas.User = Depends(get_current_user)):
+async def get_current_admin_user(current_user: schemas.Principal = Depends(get_current_user)):
     if current_user.user_type != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, 
@@ -40,7 +44,7 @@ async def get_current_admin_user(current_user: schemas.User = Depends(get_curren
         )
     return current_user
 
-async def get_current_seller_user(current_user: schemas.User = Depends(get_current_user)):
+async def get_current_seller_user(current_user: schemas.Principal = Depends(get_current_user)):
     if current_user.user_type != "seller":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, 
@@ -48,10 +52,36 @@ async def get_current_seller_user(current_user: schemas.User = Depends(get_curre
         )
     return current_user
 
-async def get_current_buyer_user(current_user: schemas.User = Depends(get_current_user)):
+async def get_current_buyer_user(current_user: schemas.Principal = Depends(get_current_user)):
     if current_user.user_type != "buyer":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, 
             detail="Only buyers can perform this action"
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+def order_history_filters(
+    statuses: list[str] | None = Query(None, alias="status"),
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=500)
+):
+    """
+    Query parameters of the order history endpoints, as keyword arguments for
+    crud.get_order_history.
+    """
+    after = None
+    if cursor is not None:
+        created_at, order_id = decode_cursor(cursor, str, int)
+        try:
+            after = (datetime.fromisoformat(created_at), order_id)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return {
+        "statuses": statuses,
+        "created_after": created_after,
+        "created_before": created_before,
+        "after": after,
+        "limit": limit,
+    }
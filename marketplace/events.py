@@ -0,0 +1,312 @@
+"""
+Per-seller change feed, streamed to sellers as Server-Sent Events.
+
+crud functions stage events on the session while they write. They are
+published when the transaction commits and dropped when it rolls back, so a
+seller never hears about an order that didn't happen.
+
+On Postgres `broker` is a PostgresBroker: events are sent with NOTIFY as part
+of the committing transaction, and every worker LISTENs and feeds its own
+streams, so a seller's stream sees the changes made by all gunicorn workers.
+On SQLite, used for local development in one process, the in-process
+LocalBroker is used. Another shared broker (Redis pub/sub for example) can be
+assigned to `events.broker` when the app starts; it needs LocalBroker's
+publish, subscribe, unsubscribe and stats methods.
+
+All workers receive the events in the same order, so a client can resume
+with `Last-Event-ID` on any worker that still buffers that event. Otherwise,
+for an id older than the replay buffer, of a seller whose buffer was dropped
+to make room for others, or from before the worker started listening, the
+client gets a `reset` event and should refetch the lists it
+keeps. Open streams get a `reset` too when a worker loses its LISTEN
+connection, since events may have been missed.
+"""
+import asyncio
+import json
+import logging
+import secrets
+from collections import OrderedDict, deque
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from .database import engine, settings
+
+logger = logging.getLogger(__name__)
+
+RESET_FRAME = b"event: reset\ndata: {}\n\n"
+
+class Subscription:
+    def __init__(self, queue_size: int):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.replay = []
+        self.reset = False
+        # Set when the client fell too far behind, its stream then ends and it
+        # resumes from the replay buffer
+        self.dropped = False
+
+    def push(self, frame: bytes) -> bool:
+        if self.dropped:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.dropped = True
+            return False
+        return True
+
+class LocalBroker:
+    # Events are published after the commit, see publish_staged_events
+    notifies_in_transaction = False
+
+    def __init__(self, buffer_size: int, queue_size: int, buffered_sellers: int):
+        self.epoch = secrets.token_hex(4)
+        self.sequence = 0
+        self.buffer_size = buffer_size
+        self.queue_size = queue_size
+        self.buffered_sellers = buffered_sellers
+        self.published = 0
+        self.dropped = 0
+        self.evicted = 0
+        # Per seller: recent (event id, frame) pairs and the open streams. The
+        # buffers of the sellers with the oldest last event are dropped beyond
+        # `buffered_sellers`, their clients get a reset if they resume.
+        self._buffers = OrderedDict()
+        self._subscribers = {}
+
+    def encode(self, event_type: str, data: dict):
+        """
+        (event id, frame) of a new event. Encoded once, every stream of the
+        seller writes the same bytes.
+        """
+        self.sequence += 1
+        event_id = f"{self.epoch}-{self.sequence}"
+        frame = (
+            f"id: {event_id}\n"
+            f"event: {event_type}\n"
+            f"data: {json.dumps(data, separators=(',', ':'))}\n\n"
+        ).encode()
+        return event_id, frame
+
+    def publish(self, seller_id: int, event_type: str, data: dict):
+        self.deliver(seller_id, *self.encode(event_type, data))
+
+    def deliver(self, seller_id: int, event_id: str, frame: bytes):
+        self.published += 1
+        buffer = self._buffers.get(seller_id)
+        if buffer is None:
+            buffer = self._buffers[seller_id] = deque(maxlen=self.buffer_size)
+            if len(self._buffers) > self.buffered_sellers:
+                self._buffers.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._buffers.move_to_end(seller_id)
+        buffer.append((event_id, frame))
+
+        for subscription in list(self._subscribers.get(seller_id, ())):
+            if not subscription.push(frame):
+                self.dropped += 1
+                self.unsubscribe(seller_id, subscription)
+
+    def subscribe(self, seller_id: int, last_event_id: str | None = None) -> Subscription:
+        subscription = Subscription(self.queue_size)
+        if last_event_id is not None:
+            buffer = self._buffers.get(seller_id, ())
+            position = next(
+                (position for position, (event_id, _) in enumerate(buffer) if event_id == last_event_id), None
+            )
+            if position is None:
+                subscription.reset = True
+            else:
+                subscription.replay = [frame for _, frame in list(buffer)[position + 1:]]
+        self._subscribers.setdefault(seller_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, seller_id: int, subscription: Subscription):
+        subscribers = self._subscribers.get(seller_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[seller_id]
+
+    def reset_streams(self):
+        """
+        Forget the replay buffers and end every open stream with a reset, for
+        when events may have been missed.
+        """
+        self._buffers.clear()
+        for subscribers in self._subscribers.values():
+            for subscription in subscribers:
+                subscription.push(RESET_FRAME)
+                subscription.dropped = True
+        self._subscribers.clear()
+
+    def stats(self):
+        return {
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+            "buffered_sellers": len(self._buffers),
+            "evicted_buffers": self.evicted,
+        }
+
+class PostgresBroker(LocalBroker):
+    """
+    LocalBroker fed by Postgres LISTEN/NOTIFY, see `run`. Listening takes one
+    pooled connection per worker.
+    """
+    notifies_in_transaction = True
+    channel = "seller_events"
+    # NOTIFY payloads must be shorter than 8000 bytes
+    max_payload = 7900
+
+    def __init__(self, buffer_size: int, queue_size: int, buffered_sellers: int):
+        super().__init__(buffer_size, queue_size, buffered_sellers)
+        self.listening = False
+
+    def notify(self, session, staged):
+        payloads = []
+        for seller_id, event_type, data in staged:
+            event_id, frame = self.encode(event_type, data)
+            payload = json.dumps([seller_id, event_id, frame.decode()])
+            if len(payload) > self.max_payload:
+                # Order events of huge carts leave out their items
+                data = {key: value for key, value in data.items() if not isinstance(value, list)}
+                event_id, frame = self.encode(event_type, {**data, "truncated": True})
+                payload = json.dumps([seller_id, event_id, frame.decode()])
+            payloads.append(payload)
+        # One round trip for all events of the transaction, delivered in this
+        # order when it commits
+        session.execute(
+            text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+            {"channel": self.channel, "payloads": payloads},
+        )
+
+    def receive(self, connection, pid, channel, payload):
+        seller_id, event_id, frame = json.loads(payload)
+        self.deliver(seller_id, event_id, frame.encode())
+
+    async def run(self):
+        """
+        LISTEN for events of all workers until cancelled, reconnecting when
+        the connection is lost.
+        """
+        while True:
+            try:
+                async with engine.connect() as conn:
+                    raw = await conn.get_raw_connection()
+                    try:
+                        await raw.driver_connection.add_listener(self.channel, self.receive)
+                        # Streams opened while not listening may have missed events
+                        self.reset_streams()
+                        self.listening = True
+                        while True:
+                            await asyncio.sleep(settings.EVENT_FEED_HEARTBEAT_SECONDS)
+                            await raw.driver_connection.execute("SELECT 1")
+                    finally:
+                        self.listening = False
+                        # Never hand a listening connection back to the pool
+                        await conn.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Event feed listener failed, reconnecting")
+            self.reset_streams()
+            await asyncio.sleep(1)
+
+    def stats(self):
+        return {**super().stats(), "listening": self.listening}
+
+if engine.dialect.name == "postgresql":
+    broker = PostgresBroker(
+        settings.EVENT_FEED_BUFFER_SIZE, settings.EVENT_FEED_QUEUE_SIZE, settings.EVENT_FEED_BUFFERED_SELLERS
+    )
+else:
+    broker = LocalBroker(
+        settings.EVENT_FEED_BUFFER_SIZE, settings.EVENT_FEED_QUEUE_SIZE, settings.EVENT_FEED_BUFFERED_SELLERS
+    )
+
+def stage(db, seller_id: int, event_type: str, data: dict):
+    """
+    Publish an event to the seller's feed once the session's transaction
+    commits.
+    """
+    db.info.setdefault("events", []).append((seller_id, event_type, data))
+
+# SQLAlchemy reports savepoints through the same commit and rollback events as
+# the transaction around them. Events staged inside a savepoint that rolls back
+# are dropped, the rest wait for the outermost commit.
+@event.listens_for(Session, "after_transaction_create")
+def mark_staged_events(session, transaction):
+    if transaction.nested:
+        session.info.setdefault("event_marks", {})[transaction] = len(session.info.get("events", ()))
+
+@event.listens_for(Session, "before_commit")
+def notify_staged_events(session):
+    if broker.notifies_in_transaction and not session.in_nested_transaction() and session.info.get("events"):
+        broker.notify(session, session.info["events"])
+
+@event.listens_for(Session, "after_commit")
+def publish_staged_events(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop("event_marks", None)
+    staged = session.info.pop("events", ())
+    if not broker.notifies_in_transaction:
+        for seller_id, event_type, data in staged:
+            broker.publish(seller_id, event_type, data)
+
+@event.listens_for(Session, "after_soft_rollback")
+def discard_staged_events(session, previous_transaction):
+    mark = session.info.get("event_marks", {}).pop(previous_transaction, None)
+    if mark is None:
+        session.info.pop("event_marks", None)
+        session.info.pop("events", None)
+    elif "events" in session.info:
+        del session.info["events"][mark:]
+
+async def event_stream(seller_id: int, last_event_id: str | None = None):
+    # The broker may be replaced at startup, a stream stays with the one it
+    # subscribed to
+    feed = broker
+    subscription = feed.subscribe(seller_id, last_event_id)
+    try:
+        yield f"retry: {settings.EVENT_FEED_RETRY_MS}\n\n".encode()
+        if subscription.reset:
+            yield RESET_FRAME
+        for frame in subscription.replay:
+            yield frame
+        while not (subscription.dropped and subscription.queue.empty()):
+            try:
+                yield await asyncio.wait_for(subscription.queue.get(), timeout=settings.EVENT_FEED_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle stream
+                yield b": keepalive\n\n"
+    finally:
+        feed.unsubscribe(seller_id, subscription)
+
+def order_created(db, order):
+    stage(db, order.seller_id, "order.created", {
+        "order_id": order.id,
+        "buyer_id": order.buyer_id,
+        "status": order.status,
+        "total_price": order.total_price,
+        "items": [
+            {"seller_product_id": item.product_item.id, "quantity": item.quantity}
+            for item in order.items
+        ],
+    })
+
+def order_status_changed(db, seller_id: int, order_id: int, previous_status: str, status: str):
+    stage(db, seller_id, "order.status_changed", {
+        "order_id": order_id,
+        "previous_status": previous_status,
+        "status": status,
+    })
+
+def stock_changed(db, seller_id: int, seller_product_id: int, product_id: int, price: float, quantity: int):
+    stage(db, seller_id, "stock.changed", {
+        "seller_product_id": seller_product_id,
+        "product_id": product_id,
+        "price": float(price),
+        "quantity": quantity,
+    })
@@ -0,0 +1,21 @@
+from fastapi.responses import StreamingResponse
+
+from . import crud
+from .database import SessionLocal, settings
+
+def order_export_response(after_id: int | None = None, **filters):
+    """
+    Stream orders as NDJSON, one schemas.Order per line in ascending id order.
+    Clients resume an interrupted export by passing the last id they received
+    as `after_id`.
+    """
+    async def generate():
+        # The request's session is closed before the body is streamed,
+        # so the export uses its own session
+        async with SessionLocal() as db:
+            async for batch in crud.iter_orders(
+                db, after_id=after_id, batch_size=settings.EXPORT_BATCH_SIZE, **filters
+            ):
+                yield b"".join(body + b"\n" for body in batch)
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
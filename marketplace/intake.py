@@ -0,0 +1,38 @@
+"""
+Background worker that places orders queued with an Idempotency-Key.
+
+Every worker process runs one. It wakes up when this process queues an order
+and polls for orders queued by the others. Batches are claimed with SKIP
+LOCKED on Postgres, so two workers never place the same request.
+"""
+import asyncio
+import logging
+
+from . import crud
+from .database import SessionLocal, settings
+
+logger = logging.getLogger(__name__)
+
+intake_ready = asyncio.Event()
+
+async def drain_order_intake():
+    batch_size = settings.ORDER_INTAKE_BATCH_SIZE
+    async with SessionLocal() as db:
+        processed = batch_size
+        while processed == batch_size:
+            processed = await crud.process_order_intake(db, limit=batch_size)
+
+async def run_intake_worker():
+    while True:
+        intake_ready.clear()
+        try:
+            await drain_order_intake()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The batch rolled back to QUEUED, try again next round
+            logger.exception("Order intake batch failed")
+        try:
+            await asyncio.wait_for(intake_ready.wait(), timeout=settings.ORDER_INTAKE_POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
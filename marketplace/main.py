@@ -1,17 +1,37 @@
-from fastapi import FastAPI
+import asyncio
+from fastapi import Depends, FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from .database import engine, Base
+from . import events
+from .database import pool_stats, settings
+from .dependencies import get_current_admin_user
+from .intake import run_intake_worker
+from .metrics import MetricsMiddleware, render_metrics
+from .migrations import migrate
+from .reservations import run_sweeper
+from .snapshot import catalog_snapshot, run_snapshot_builder
 from .routers import users, products, seller, orders
 
-async def create_tables():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-
 app = FastAPI()
 
 @app.on_event("startup")
 async def on_startup():
-    await create_tables()
+    # Schema changes are applied once per deploy with
+    # `python -m marketplace.migrations`, not by every worker
+    if settings.AUTO_MIGRATE:
+        await migrate()
+    app.state.reservation_sweeper = asyncio.create_task(run_sweeper())
+    app.state.intake_worker = asyncio.create_task(run_intake_worker())
+    app.state.background_tasks = [app.state.reservation_sweeper, app.state.intake_worker]
+    if catalog_snapshot is not None:
+        app.state.background_tasks.append(asyncio.create_task(run_snapshot_builder()))
+    if isinstance(events.broker, events.PostgresBroker):
+        app.state.background_tasks.append(asyncio.create_task(events.broker.run()))
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    for task in app.state.background_tasks:
+        task.cancel()
 
 origins = [
     "http://localhost:5173",
@@ -24,8 +44,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Location"],
 )
 
+# Added last so it wraps CORS and measures the whole request
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(users.router)
 app.include_router(products.router)
 app.include_router(seller.router)
@@ -33,4 +57,18 @@ app.include_router(orders.router)
 
 @app.get("/")
 def read_root():
-    return {"message": "Welcome to the Marketplace API"}
\ No newline at end of file
+    return {"message": "Welcome to the Marketplace API"}
+
+@app.get("/stats/db-pool", dependencies=[Depends(get_current_admin_user)])
+async def read_db_pool_stats():
+    """
+    Live connection pool statistics for this worker. Admin only.
+    """
+    return pool_stats()
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def read_metrics():
+    """
+    Prometheus metrics for the worker serving the scrape.
+    """
+    return render_metrics()
\ No newline at end of file
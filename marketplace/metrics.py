@@ -0,0 +1,227 @@
+"""
+Per-request SQL and timing instrumentation.
+
+SQLAlchemy cursor events count statements and database time for the request
+being served. MetricsMiddleware reports them in a Server-Timing header and
+feeds in-process Prometheus histograms, rendered by `render_metrics` for the
+/metrics endpoint. Every gunicorn worker keeps its own series.
+"""
+import os
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+from . import security
+from .cache import principal_cache, product_detail_cache, product_list_cache
+from .database import engine, pool_stats
+from . import events
+from .singleflight import read_flights
+from .snapshot import catalog_snapshot
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+current_request_stats: ContextVar[RequestStats | None] = ContextVar("current_request_stats", default=None)
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - started
+
+@event.listens_for(engine.sync_engine, "handle_error")
+def drop_query_timer(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self.series.get(labels)
+        if series is None:
+            # One count per bucket, then +Inf, sum and count
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-3] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self, label_names: tuple):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            label_text = format_labels(label_names, labels)
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{label_text}}} {series[-1]}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.series = {}
+
+    def inc(self, labels: tuple, amount: int = 1):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self, label_names: tuple):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{{{format_labels(label_names, labels)}}} {value}")
+        return lines
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(names: tuple, values: tuple) -> str:
+    return ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values))
+
+ROUTE_LABELS = ("method", "route")
+
+request_latency = Histogram(
+    "http_request_duration_seconds", "Request latency by route.", LATENCY_BUCKETS
+)
+request_queries = Histogram(
+    "http_request_db_queries", "SQL statements executed per request.", QUERY_COUNT_BUCKETS
+)
+request_db_time = Histogram(
+    "http_request_db_duration_seconds", "Database time per request.", LATENCY_BUCKETS
+)
+requests_total = Counter("http_requests_total", "Requests by route and status code.")
+request_errors = Counter("http_request_errors_total", "Requests that failed with a 5xx or an unhandled exception.")
+
+def route_label(scope) -> str:
+    # Route templates keep the label set small, unmatched paths share one label
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.queries} queries", '
+                    f"app;dur={elapsed_ms:.2f}",
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception:
+            status_code = 500
+            raise
+        finally:
+            current_request_stats.reset(token)
+            labels = (scope["method"], route_label(scope))
+            request_latency.observe(labels, time.perf_counter() - started)
+            request_queries.observe(labels, stats.queries)
+            request_db_time.observe(labels, stats.db_seconds)
+            requests_total.inc(labels + (status_code,))
+            if status_code >= 500:
+                request_errors.inc(labels)
+
+def single_value(name: str, help: str, value, kind: str = "gauge"):
+    return [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+def render_metrics() -> str:
+    lines = [f"# Worker pid {os.getpid()}"]
+    lines += request_latency.render(ROUTE_LABELS)
+    lines += request_queries.render(ROUTE_LABELS)
+    lines += request_db_time.render(ROUTE_LABELS)
+    lines += requests_total.render(ROUTE_LABELS + ("status",))
+    lines += request_errors.render(ROUTE_LABELS)
+
+    pool = pool_stats()
+    if "checked_out" in pool:
+        lines += single_value("db_pool_checked_out", "Connections currently checked out.", pool["checked_out"])
+        lines += single_value("db_pool_overflow", "Connections opened beyond pool_size.", max(pool["overflow"], 0))
+        lines += single_value("db_pool_checkouts_total", "Connection checkouts.", pool["checkouts"], "counter")
+        lines += single_value(
+            "db_pool_wait_seconds_total", "Time spent waiting for a connection.", pool["wait_seconds_total"], "counter"
+        )
+        lines += single_value("db_pool_wait_seconds_max", "Longest wait for a connection.", pool["wait_seconds_max"])
+
+    lines += single_value(
+        "password_jobs_in_flight", "Password hashing jobs running or queued.", security.password_jobs
+    )
+
+    caches = {"principal": principal_cache, "products": product_list_cache, "product_detail": product_detail_cache}
+    for stat in ("hits", "misses", "evictions", "size"):
+        kind = "gauge" if stat == "size" else "counter"
+        name = f"cache_{stat}" if stat == "size" else f"cache_{stat}_total"
+        lines += [f"# HELP {name} Cache {stat} by cache.", f"# TYPE {name} {kind}"]
+        for cache_name, cache in caches.items():
+            lines.append(f'{name}{{cache="{cache_name}"}} {cache.stats()[stat]}')
+
+    flights = read_flights.stats()
+    lines += ["# HELP singleflight_calls_total Coalesced reads by route.", "# TYPE singleflight_calls_total counter"]
+    lines += [f'singleflight_calls_total{{route="{route}"}} {stats["calls"]}' for route, stats in flights.items()]
+    lines += [
+        "# HELP singleflight_executions_total Loader runs by route, calls per execution is the fan-in.",
+        "# TYPE singleflight_executions_total counter",
+    ]
+    lines += [f'singleflight_executions_total{{route="{route}"}} {stats["executions"]}' for route, stats in flights.items()]
+    lines += single_value("singleflight_in_flight", "Coalesced reads currently running.", len(read_flights))
+
+    if catalog_snapshot is not None:
+        snapshot = catalog_snapshot.stats()
+        lines += single_value("catalog_snapshot_hits_total", "Catalog reads served from the snapshot.", snapshot["hits"], "counter")
+        lines += single_value(
+            "catalog_snapshot_misses_total", "Catalog reads that went to the database instead.", snapshot["misses"], "counter"
+        )
+        lines += single_value("catalog_snapshot_stale_products", "Products changed since the snapshot.", snapshot["stale_products"])
+        lines += single_value("catalog_snapshot_patches_total", "Snapshot files patched.", snapshot["patches"], "counter")
+        lines += single_value("catalog_snapshot_full_builds_total", "Snapshot files rebuilt from scratch.", snapshot["full_builds"], "counter")
+
+    feed = events.broker.stats()
+    lines += single_value("event_feed_subscribers", "Open seller event streams.", feed["subscribers"])
+    lines += single_value("event_feed_published_total", "Events published to seller feeds.", feed["published"], "counter")
+    lines += single_value(
+        "event_feed_dropped_total", "Streams dropped for falling behind, they resume from the replay buffer.", feed["dropped"], "counter"
+    )
+    lines += single_value("event_feed_buffered_sellers", "Sellers with a replay buffer.", feed["buffered_sellers"])
+    lines += single_value(
+        "event_feed_evicted_buffers_total", "Replay buffers dropped for the sellers with the oldest events.", feed["evicted_buffers"], "counter"
+    )
+
+    return "\n".join(lines) + "\n"
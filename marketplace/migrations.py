@@ -0,0 +1,328 @@
+"""
+Versioned schema migrations.
+
+Run once per deploy, before the web workers start:
+
+    python -m marketplace.migrations
+
+Applied versions are recorded in the schema_migrations table, so running it
+again only applies what is new. Migrations must be idempotent against a fresh
+database, because version 1 creates the schema from the current models.
+"""
+import asyncio
+import json
+from datetime import datetime, timezone
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+
+from . import models
+from .database import Base, engine
+
+migrations_table = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False),
+)
+
+# Arbitrary key for the Postgres advisory lock that serializes runners
+MIGRATION_LOCK_ID = 7283401
+
+def create_initial_schema(conn):
+    Base.metadata.create_all(conn)
+
+def create_indexes(*indexes):
+    def migration(conn):
+        for index in indexes:
+            index.create(conn, checkfirst=True)
+    return migration
+
+def create_product_search_index(conn):
+    # Kept in sync by the database itself, so every write path (create_product,
+    # the bulk endpoint, manual fixes) is searchable right away
+    if conn.dialect.name == "sqlite":
+        statements = [
+            """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                name, description, content='products', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )""",
+            """CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+                INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+                INSERT INTO products_fts(products_fts, rowid, name, description)
+                VALUES ('delete', old.id, old.name, old.description);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE ON products BEGIN
+                INSERT INTO products_fts(products_fts, rowid, name, description)
+                VALUES ('delete', old.id, old.name, old.description);
+                INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+            END""",
+            "INSERT INTO products_fts(products_fts) VALUES ('rebuild')",
+        ]
+    elif conn.dialect.name == "postgresql":
+        statements = [
+            """ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector
+                GENERATED ALWAYS AS (
+                    setweight(to_tsvector('simple', coalesce(name, '')), 'A')
+                    || setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+                ) STORED""",
+            "CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING GIN (search_vector)",
+        ]
+    else:
+        raise RuntimeError(f"Product search is not supported on {conn.dialect.name}")
+
+    for statement in statements:
+        conn.exec_driver_sql(statement)
+
+def add_empty_offer_summaries(conn):
+    # Products created since version 4 only got a summary with their first
+    # offer, they get the zero row the backfill gave products without offers
+    conn.exec_driver_sql("""
+        INSERT INTO product_offer_summaries (product_id, min_price, seller_count, total_quantity, best_seller_id)
+        SELECT products.id, NULL, 0, 0, NULL
+        FROM products
+        WHERE NOT EXISTS (SELECT 1 FROM product_offer_summaries AS summaries WHERE summaries.product_id = products.id)
+    """)
+
+def create_product_name_pattern_index(conn):
+    # Under a linguistic collation the btree on products.name can't serve
+    # LIKE 'prefix%', text_pattern_ops compares character by character. SQLite
+    # uses ix_products_name for its range bound.
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_products_name_pattern ON products (name text_pattern_ops)"
+        )
+
+def create_offer_summaries(conn):
+    models.ProductOfferSummary.__table__.create(conn, checkfirst=True)
+    find_index(models.SellerProduct.__table__, "ix_seller_products_product_id").create(conn, checkfirst=True)
+    conn.execute(models.ProductOfferSummary.__table__.delete())
+    conn.exec_driver_sql("""
+        INSERT INTO product_offer_summaries (product_id, min_price, seller_count, total_quantity, best_seller_id)
+        SELECT
+            products.id,
+            MIN(offers.price),
+            COUNT(offers.id),
+            COALESCE(SUM(offers.quantity), 0),
+            (
+                SELECT best.seller_id FROM seller_products AS best
+                WHERE best.product_id = products.id AND best.quantity > 0
+                ORDER BY best.price, best.id LIMIT 1
+            )
+        FROM products
+        LEFT JOIN seller_products AS offers ON offers.product_id = products.id AND offers.quantity > 0
+        GROUP BY products.id
+    """)
+
+def create_sales_rollups(conn):
+    # Orders placed before this migration have no recorded time, they are
+    # dated to the moment it runs
+    if "created_at" not in {column["name"] for column in inspect(conn).get_columns("orders")}:
+        conn.exec_driver_sql("ALTER TABLE orders ADD COLUMN created_at TIMESTAMP WITH TIME ZONE")
+    conn.execute(
+        models.Order.__table__.update()
+        .where(models.Order.created_at.is_(None))
+        .values(created_at=datetime.now(timezone.utc))
+    )
+
+    models.SellerDailySales.__table__.create(conn, checkfirst=True)
+    models.SellerProductDailySales.__table__.create(conn, checkfirst=True)
+    conn.execute(models.SellerDailySales.__table__.delete())
+    conn.execute(models.SellerProductDailySales.__table__.delete())
+
+    if conn.dialect.name == "postgresql":
+        day = "CAST(orders.created_at AT TIME ZONE 'UTC' AS DATE)"
+    else:
+        day = "date(orders.created_at)"
+    conn.exec_driver_sql(f"""
+        INSERT INTO seller_daily_sales (seller_id, day, status, order_count, units_sold, revenue)
+        SELECT orders.seller_id, {day}, orders.status, COUNT(*), COALESCE(SUM(units.units_sold), 0), SUM(orders.total_price)
+        FROM orders
+        LEFT JOIN (
+            SELECT order_id, SUM(quantity) AS units_sold FROM order_items GROUP BY order_id
+        ) AS units ON units.order_id = orders.id
+        GROUP BY orders.seller_id, {day}, orders.status
+    """)
+    conn.exec_driver_sql(f"""
+        INSERT INTO seller_product_daily_sales (seller_id, product_id, day, status, order_count, units_sold, revenue)
+        SELECT
+            orders.seller_id, seller_products.product_id, {day}, orders.status,
+            COUNT(DISTINCT orders.id), SUM(order_items.quantity), SUM(order_items.quantity * order_items.price_at_purchase)
+        FROM orders
+        JOIN order_items ON order_items.order_id = orders.id
+        JOIN seller_products ON seller_products.id = order_items.seller_product_id
+        GROUP BY orders.seller_id, seller_products.product_id, {day}, orders.status
+    """)
+
+def create_reservations(conn):
+    models.Reservation.__table__.create(conn, checkfirst=True)
+
+def create_order_intake(conn):
+    models.OrderIntake.__table__.create(conn, checkfirst=True)
+
+def create_order_snapshots(conn):
+    # Filled by the snapshot rebuild of version 11
+    models.OrderSnapshot.__table__.create(conn, checkfirst=True)
+
+def json_datetime(value):
+    # Same text as pydantic writes for the UTC datetimes orders are created
+    # with; SQLite reads them back without the zone
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat().replace("+00:00", "Z")
+
+def order_snapshot_row(order, items):
+    """
+    OrderSnapshot row in the schemas.Order shape of this migration. The shape
+    is pinned here rather than taken from schemas, so the migration writes the
+    same bodies whenever it runs; the status is cut out as in
+    crud.order_snapshot_row. The offer shows the price paid, as in snapshots
+    written when an order is placed, and its current stock, as the stock left
+    after an old order isn't known.
+    """
+    body = json.dumps({
+        "id": order.id,
+        "buyer_id": order.buyer_id,
+        "seller_id": order.seller_id,
+        "total_price": order.total_price,
+        "status": order.status,
+        "created_at": json_datetime(order.created_at),
+        "items": [
+            {
+                "seller_product_id": item.seller_product_id,
+                "quantity": item.quantity,
+                "id": item.id,
+                "price_at_purchase": item.price_at_purchase,
+                "product_item": {
+                    "price": item.price_at_purchase,
+                    "quantity": item.stock,
+                    "id": item.seller_product_id,
+                    "seller_id": item.seller_id,
+                    "product_id": item.product_id,
+                    "product": {"id": item.product_id, "name": item.name, "description": item.description},
+                    "seller": {"id": item.seller_id, "email": item.email},
+                },
+            }
+            for item in items
+        ],
+    }, ensure_ascii=False, separators=(",", ":")).encode()
+    status_key = b'"status":'
+    status_offset = body.index(status_key) + len(status_key)
+    status = json.dumps(order.status, ensure_ascii=False).encode()
+    return {
+        "order_id": order.id,
+        "status_offset": status_offset,
+        "body": body[:status_offset] + body[status_offset + len(status):],
+    }
+
+def rebuild_order_snapshots(conn):
+    # Version 9 used to backfill snapshots with the offers' price of the day
+    # it ran rather than the price paid. Orders are snapshotted as they look now, in batches so a
+    # large history is never loaded at once.
+    orders, snapshots = models.Order.__table__, models.OrderSnapshot.__table__
+    order_items, seller_products = models.OrderItem.__table__, models.SellerProduct.__table__
+    products, users = models.Product.__table__, models.User.__table__
+    conn.execute(snapshots.delete())
+    after_id = 0
+    while True:
+        batch = conn.execute(
+            select(orders.c.id, orders.c.buyer_id, orders.c.seller_id, orders.c.total_price, orders.c.status, orders.c.created_at)
+            .filter(orders.c.id > after_id)
+            .order_by(orders.c.id)
+            .limit(500)
+        ).all()
+        if not batch:
+            break
+        items = {order.id: [] for order in batch}
+        for item in conn.execute(
+            select(
+                order_items.c.order_id,
+                order_items.c.seller_product_id,
+                order_items.c.quantity,
+                order_items.c.id,
+                order_items.c.price_at_purchase,
+                seller_products.c.quantity.label("stock"),
+                seller_products.c.seller_id,
+                seller_products.c.product_id,
+                products.c.name,
+                products.c.description,
+                users.c.email,
+            )
+            .join(seller_products, seller_products.c.id == order_items.c.seller_product_id)
+            .join(products, products.c.id == seller_products.c.product_id)
+            .join(users, users.c.id == seller_products.c.seller_id)
+            .filter(order_items.c.order_id.in_(items))
+            .order_by(order_items.c.id)
+        ):
+            items[item.order_id].append(item)
+        conn.execute(snapshots.insert(), [order_snapshot_row(order, items[order.id]) for order in batch])
+        after_id = batch[-1].id
+
+def add_order_intake_attempts(conn):
+    if "attempts" not in {column["name"] for column in inspect(conn).get_columns("order_intake")}:
+        conn.exec_driver_sql("ALTER TABLE order_intake ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+def find_index(table, name):
+    return next(index for index in table.indexes if index.name == name)
+
+MIGRATIONS = [
+    (1, "initial schema", create_initial_schema),
+    (2, "hot query indexes", create_indexes(
+        find_index(models.SellerProduct.__table__, "uq_seller_products_seller_id_product_id"),
+        find_index(models.Order.__table__, "ix_orders_seller_id_id"),
+        find_index(models.Order.__table__, "ix_orders_buyer_id_id"),
+        find_index(models.OrderItem.__table__, "ix_order_items_order_id"),
+    )),
+    (3, "product full-text search", create_product_search_index),
+    (4, "product offer summaries", create_offer_summaries),
+    (5, "seller sales rollups", create_sales_rollups),
+    (6, "stock reservations", create_reservations),
+    (7, "order intake queue", create_order_intake),
+    (8, "order history indexes", create_indexes(
+        find_index(models.Order.__table__, "ix_orders_seller_id_created_at_id"),
+        find_index(models.Order.__table__, "ix_orders_seller_id_status_created_at_id"),
+        find_index(models.Order.__table__, "ix_orders_buyer_id_created_at_id"),
+        find_index(models.Order.__table__, "ix_orders_buyer_id_status_created_at_id"),
+    )),
+    (9, "order snapshots", create_order_snapshots),
+    (10, "order intake attempts", add_order_intake_attempts),
+    (11, "order snapshots with purchase prices", rebuild_order_snapshots),
+    (12, "product name prefix index", create_product_name_pattern_index),
+    (13, "empty offer summaries", add_empty_offer_summaries),
+]
+
+def apply_migrations(conn):
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": MIGRATION_LOCK_ID})
+
+    migrations_table.create(conn, checkfirst=True)
+    applied = set(conn.scalars(select(migrations_table.c.version)))
+
+    newly_applied = []
+    for version, name, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        migration(conn)
+        conn.execute(migrations_table.insert().values(
+            version=version, name=name, applied_at=datetime.now(timezone.utc)
+        ))
+        newly_applied.append((version, name))
+    return newly_applied
+
+async def migrate():
+    async with engine.begin() as conn:
+        return await conn.run_sync(apply_migrations)
+
+async def main():
+    applied = await migrate()
+    for version, name in applied:
+        print(f"Applied migration {version}: {name}")
+    if not applied:
+        print("Database schema is up to date.")
+    await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,5 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float
+from datetime import datetime, timezone
+from sqlalchemy import JSON, Boolean, Column, Date, DateTime, ForeignKey, Index, Integer, LargeBinary, String, Float
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -22,6 +23,7 @@ class Product(Base):
     image_url = Column(String, nullable=True)
 
     sellers = relationship("SellerProduct", back_populates="product")
+    offer_summary = relationship("ProductOfferSummary", back_populates="product", uselist=False)
 
 class SellerProduct(Base):
     __tablename__ = "seller_products"
@@ -29,11 +31,28 @@ class SellerProduct(Base):
     price = Column(Float)
     quantity = Column(Integer)
     seller_id = Column(Integer, ForeignKey("users.id"))
-    product_id = Column(Integer, ForeignKey("products.id"))
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
 
     seller = relationship("User", back_populates="selling_products")
     product = relationship("Product", back_populates="sellers")
 
+    __table_args__ = (
+        # A seller lists each master product once
+        Index("uq_seller_products_seller_id_product_id", "seller_id", "product_id", unique=True),
+    )
+
+class ProductOfferSummary(Base):
+    # Aggregate over the in-stock SellerProduct rows of a product, maintained by
+    # crud.refresh_offer_summaries whenever inventory or stock changes
+    __tablename__ = "product_offer_summaries"
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    min_price = Column(Float, nullable=True)
+    seller_count = Column(Integer, default=0)
+    total_quantity = Column(Integer, default=0)
+    best_seller_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+
+    product = relationship("Product", back_populates="offer_summary")
+
 class Order(Base):
     __tablename__ = "orders"
     id = Column(Integer, primary_key=True, index=True)
@@ -41,18 +60,98 @@ class Order(Base):
     seller_id = Column(Integer, ForeignKey("users.id"))
     total_price = Column(Float)
     status = Column(String, default="PENDING") # PENDING, CONFIRMED, CANCELED
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
 
     buyer = relationship("User", foreign_keys=[buyer_id], back_populates="purchase_orders")
     seller = relationship("User", foreign_keys=[seller_id], back_populates="sale_orders")
     items = relationship("OrderItem", back_populates="order")
 
+    __table_args__ = (
+        Index("ix_orders_seller_id_id", "seller_id", "id"),
+        Index("ix_orders_buyer_id_id", "buyer_id", "id"),
+        # Order history pages, with and without a status filter
+        Index("ix_orders_seller_id_created_at_id", "seller_id", "created_at", "id"),
+        Index("ix_orders_seller_id_status_created_at_id", "seller_id", "status", "created_at", "id"),
+        Index("ix_orders_buyer_id_created_at_id", "buyer_id", "created_at", "id"),
+        Index("ix_orders_buyer_id_status_created_at_id", "buyer_id", "status", "created_at", "id"),
+    )
+
 class OrderItem(Base):
     __tablename__ = "order_items"
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"))
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
     seller_product_id = Column(Integer, ForeignKey("seller_products.id"))
     quantity = Column(Integer)
     price_at_purchase = Column(Float)
 
     order = relationship("Order", back_populates="items")
     product_item = relationship("SellerProduct")
+
+class OrderSnapshot(Base):
+    # schemas.Order JSON of an order as it was placed, written once by
+    # crud.add_order_snapshots, so later product or price edits don't change
+    # order history. The status is cut out of `body` and spliced back in at
+    # `status_offset` from orders.status when read, status changes never
+    # rewrite it.
+    __tablename__ = "order_snapshots"
+    order_id = Column(Integer, ForeignKey("orders.id"), primary_key=True)
+    status_offset = Column(Integer, nullable=False)
+    body = Column(LargeBinary, nullable=False)
+
+class Reservation(Base):
+    # Stock held for a buyer. The units are already taken off
+    # SellerProduct.quantity; checkout turns the hold into an order, the
+    # sweeper puts expired holds back into stock.
+    __tablename__ = "reservations"
+    id = Column(Integer, primary_key=True, index=True)
+    buyer_id = Column(Integer, ForeignKey("users.id"), index=True)
+    seller_product_id = Column(Integer, ForeignKey("seller_products.id"))
+    quantity = Column(Integer)
+    expires_at = Column(DateTime(timezone=True), index=True)
+
+class OrderIntake(Base):
+    # An order request accepted with an Idempotency-Key and placed later by the
+    # intake worker. QUEUED until processed, then DONE with order_id or FAILED
+    # with the error the synchronous endpoint would have returned.
+    __tablename__ = "order_intake"
+    id = Column(Integer, primary_key=True, index=True)
+    buyer_id = Column(Integer, ForeignKey("users.id"))
+    idempotency_key = Column(String)
+    payload = Column(JSON)
+    status = Column(String, default="QUEUED") # QUEUED, DONE, FAILED
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=True)
+    status_code = Column(Integer, nullable=True)
+    detail = Column(String, nullable=True)
+    # Times placing it raised something other than an HTTPException
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("uq_order_intake_buyer_id_idempotency_key", "buyer_id", "idempotency_key", unique=True),
+        # The worker picks up the oldest queued requests
+        Index("ix_order_intake_status_id", "status", "id"),
+    )
+
+class SellerDailySales(Base):
+    # Orders of a seller per UTC day of Order.created_at and current status,
+    # maintained by crud.record_sales when orders are placed or change status
+    __tablename__ = "seller_daily_sales"
+    seller_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    status = Column(String, primary_key=True)
+    order_count = Column(Integer, default=0)
+    units_sold = Column(Integer, default=0)
+    revenue = Column(Float, default=0)
+
+class SellerProductDailySales(Base):
+    # Same as SellerDailySales, split by master product. order_count is the
+    # number of orders containing the product.
+    __tablename__ = "seller_product_daily_sales"
+    seller_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    status = Column(String, primary_key=True)
+    order_count = Column(Integer, default=0)
+    units_sold = Column(Integer, default=0)
+    revenue = Column(Float, default=0)
@@ -0,0 +1,28 @@
+import base64
+import json
+from fastapi import HTTPException, status
+
+# Opaque keyset cursors: the sort key values of the last row on a page,
+# JSON encoded and wrapped in urlsafe base64 so clients treat them as tokens.
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, *types) -> list:
+    """
+    Decode a cursor made by encode_cursor, checking each value against `types`.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        values = None
+
+    if (
+        not isinstance(values, list)
+        or len(values) != len(types)
+        or not all(isinstance(value, kind) for value, kind in zip(values, types))
+    ):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return values
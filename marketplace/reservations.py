@@ -0,0 +1,31 @@
+"""
+Background sweeper that puts the stock of expired reservations back.
+
+Every worker runs one. Batches are claimed with SKIP LOCKED on Postgres, so
+sweepers of different workers never release the same hold twice.
+"""
+import asyncio
+import logging
+
+from . import crud
+from .database import SessionLocal, settings
+
+logger = logging.getLogger(__name__)
+
+async def sweep_expired_reservations():
+    batch_size = settings.RESERVATION_SWEEP_BATCH_SIZE
+    async with SessionLocal() as db:
+        released = batch_size
+        while released == batch_size:
+            released = await crud.release_expired_reservations(db, limit=batch_size)
+
+async def run_sweeper():
+    while True:
+        try:
+            await sweep_expired_reservations()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Try again next round, expired holds just stay out of stock a bit longer
+            logger.exception("Reservation sweep failed")
+        await asyncio.sleep(settings.RESERVATION_SWEEP_INTERVAL_SECONDS)
@@ -1,34 +1,157 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 
 from .. import crud, schemas
 from ..database import get_db
-from ..dependencies import get_current_buyer_user
+from ..dependencies import get_current_buyer_user, order_history_filters
+from ..export import order_export_response
+from ..intake import intake_ready
+from ..metrics import current_request_stats
+from ..pagination import encode_cursor
+from ..serialization import json_array, json_response
 
 router = APIRouter(
     prefix="/orders",
     tags=["orders"],
 )
 
-@router.post("/", response_model=schemas.Order)
+@router.post("/", response_model=schemas.Order, responses={202: {"model": schemas.OrderIntake}})
 async def create_new_order(
     order: schemas.OrderCreate,
+    idempotency_key: str | None = Header(None, max_length=255),
     db: AsyncSession = Depends(get_db),
-    current_buyer: schemas.User = Depends(get_current_buyer_user)
+    current_buyer: schemas.Principal = Depends(get_current_buyer_user)
 ):
     """
     Create a new order. Buyer must login.
     Order contains items from a single seller.
+
+    With an `Idempotency-Key` header the order is queued instead and the
+    response is 202 with a status URL. Retrying with the same key never places
+    a second order, it returns the queued status or the outcome of the first
+    request.
+    """
+    if idempotency_key is None:
+        new_order = await crud.create_order(db=db, order_data=order, buyer_id=current_buyer.id)
+        return json_response(schemas.Order, new_order)
+
+    entry = await crud.enqueue_order(db=db, order_data=order, buyer_id=current_buyer.id, idempotency_key=idempotency_key)
+    return await intake_result(db, entry)
+
+@router.post("/checkout", response_model=schemas.CartCheckoutResult)
+async def checkout_cart(
+    cart: schemas.CartCheckout,
+    db: AsyncSession = Depends(get_db),
+    current_buyer: schemas.Principal = Depends(get_current_buyer_user)
+):
+    """
+    Check out a cart with items from any number of sellers. Buyer must login.
+    Places one order per seller, all or none of them. `round_trips` is the
+    number of database round trips the checkout took, COMMIT included.
+    """
+    stats = current_request_stats.get()
+    started = stats.queries if stats is not None else 0
+    orders = await crud.checkout_cart(db=db, cart=cart, buyer_id=current_buyer.id)
+    round_trips = stats.queries - started + 1 if stats is not None else None
+    return json_response(schemas.CartCheckoutResult, {"orders": orders, "round_trips": round_trips})
+
+@router.get("/intake/{intake_id}", response_model=schemas.OrderIntake)
+async def read_order_intake(
+    intake_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_buyer: schemas.Principal = Depends(get_current_buyer_user)
+):
+    """
+    Status of an order queued with an Idempotency-Key.
+    """
+    entry = await crud.get_order_intake(db, buyer_id=current_buyer.id, intake_id=intake_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Order request not found")
+    return json_response(schemas.OrderIntake, intake_status(entry))
+
+async def intake_result(db: AsyncSession, entry):
+    if entry.status == "DONE":
+        return Response(content=await crud.get_order_json(db, entry.order_id), media_type="application/json")
+    if entry.status == "FAILED":
+        raise HTTPException(status_code=entry.status_code, detail=entry.detail)
+
+    intake_ready.set()
+    status = intake_status(entry)
+    return json_response(schemas.OrderIntake, status, status_code=202, headers={"Location": status["status_url"]})
+
+def intake_status(entry):
+    return {
+        "id": entry.id,
+        "status": entry.status,
+        "status_url": f"/orders/intake/{entry.id}",
+        "order_id": entry.order_id,
+        "status_code": entry.status_code,
+        "detail": entry.detail,
+    }
+
+@router.post("/reservations", response_model=schemas.Reservation)
+async def reserve_stock(
+    reservation: schemas.ReservationCreate,
+    db: AsyncSession = Depends(get_db),
+    current_buyer: schemas.Principal = Depends(get_current_buyer_user)
+):
+    """
+    Hold stock of a seller product for a short time. Buyer must login.
+    Unused holds go back into stock once `expires_at` has passed.
     """
-    return await crud.create_order(db=db, order_data=order, buyer_id=current_buyer.id)
+    db_reservation = await crud.reserve_stock(db=db, reservation=reservation, buyer_id=current_buyer.id)
+    return json_response(schemas.Reservation, db_reservation)
+
+@router.delete("/reservations/{reservation_id}", status_code=204)
+async def release_reservation(
+    reservation_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_buyer: schemas.Principal = Depends(get_current_buyer_user)
+):
+    """
+    Give up a hold and put its stock back right away.
+    """
+    await crud.release_reservation(db=db, reservation_id=reservation_id, buyer_id=current_buyer.id)
+    return Response(status_code=204)
+
+@router.post("/reservations/checkout", response_model=schemas.Order)
+async def checkout_reservations(
+    checkout: schemas.ReservationCheckout,
+    db: AsyncSession = Depends(get_db),
+    current_buyer: schemas.Principal = Depends(get_current_buyer_user)
+):
+    """
+    Turn unexpired holds into an order. All held items must come from a
+    single seller.
+    """
+    new_order = await crud.checkout_reservations(db=db, checkout=checkout, buyer_id=current_buyer.id)
+    return json_response(schemas.Order, new_order)
 
 @router.get("/my-history", response_model=List[schemas.Order])
 async def read_buyer_order_history(
+    filters: dict = Depends(order_history_filters),
     db: AsyncSession = Depends(get_db),
-    current_buyer: schemas.User = Depends(get_current_buyer_user)
+    current_buyer: schemas.Principal = Depends(get_current_buyer_user)
+):
+    """
+    Get order history for the currently logged-in buyer, oldest first.
+    Takes the same filters and cursor as GET /seller/orders.
+    """
+    orders = await crud.get_orders_for_buyer(db=db, buyer_id=current_buyer.id, **filters)
+    headers = {}
+    if len(orders) == filters["limit"]:
+        last_id, last_created_at, _ = orders[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last_created_at.isoformat(), last_id)
+    return Response(content=json_array(body for _, _, body in orders), media_type="application/json", headers=headers)
+
+@router.get("/my-history/export")
+async def export_buyer_order_history(
+    after_id: int | None = None,
+    current_buyer: schemas.Principal = Depends(get_current_buyer_user)
 ):
     """
-    Get order history for the currently logged-in buyer.
+    Stream the order history of the currently logged-in buyer as NDJSON.
+    Pass the last received order id as `after_id` to resume.
     """
-    return await crud.get_orders_for_buyer(db=db, buyer_id=current_buyer.id)
\ No newline at end of file
+    return order_export_response(after_id=after_id, buyer_id=current_buyer.id)
\ No newline at end of file
@@ -1,38 +1,167 @@
-from fastapi import APIRouter, Depends, HTTPException
+import re
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 
 from .. import crud, schemas
-from ..database import get_db
+from ..cache import etag_matches, make_etag, product_detail_cache, product_list_cache
+from ..bulk import iter_chunks
+from ..database import SessionLocal, get_db, settings
 from ..dependencies import get_current_admin_user
+from ..pagination import decode_cursor, encode_cursor
+from ..serialization import dump_json, json_response
+from ..singleflight import read_flights
+from ..snapshot import catalog_snapshot, current_snapshot
 
 router = APIRouter(
     prefix="/products",
     tags=["products"],
 )
 
+MAX_SEARCH_TERMS = 8
+
 @router.post("/", response_model=schemas.Product, dependencies=[Depends(get_current_admin_user)])
 async def create_new_product(product: schemas.ProductCreate, db: AsyncSession = Depends(get_db)):
     """
     Create a new master product. Admin only.
     """
-    return await crud.create_product(db=db, product=product)
+    db_product = await crud.create_product(db=db, product=product)
+    return json_response(schemas.Product, db_product)
+
+@router.post("/bulk", response_model=schemas.BulkResult, dependencies=[Depends(get_current_admin_user)])
+async def bulk_create_products(request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Create many master products from a streamed NDJSON body (one product per
+    line) or a CSV body with a header row (Content-Type: text/csv). Admin only.
+    Rows are inserted in chunks, invalid rows are reported by row number.
+    """
+    summary = schemas.BulkResult()
+    async for rows, errors in iter_chunks(request, schemas.ProductCreate, settings.BULK_CHUNK_SIZE):
+        summary.created += await crud.bulk_create_products(db, [product for _, product in rows])
+        summary.errors.extend(schemas.BulkRowError(**error) for error in errors)
+    return summary
+
+@router.get("/cache/stats", dependencies=[Depends(get_current_admin_user)])
+async def read_catalog_cache_stats():
+    """
+    Hit/miss counters of this worker's catalog caches. Admin only.
+    """
+    return {
+        "products": product_list_cache.stats(),
+        "product_detail": product_detail_cache.stats(),
+        "singleflight": read_flights.stats(),
+        "snapshot": catalog_snapshot.stats() if catalog_snapshot is not None else None,
+    }
 
-@router.get("/", response_model=List[schemas.Product])
-async def read_products(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
+@router.get("/", response_model=List[schemas.ProductListing] | List[schemas.Product])
+async def read_products(
+    request: Request,
+    skip: int = 0,
+    limit: int = Query(100, ge=1),
+    cursor: str | None = None,
+    name_prefix: str | None = None,
+    compact: bool = False
+):
     """
     Get all master products. Public can access.
+    Pass the X-Next-Cursor response header back as `cursor` to get the next page.
+    `compact=true` leaves out the nested sellers list.
+    """
+    after_id = None
+    if cursor is not None:
+        after_id, = decode_cursor(cursor, int)
+
+    snapshot = current_snapshot()
+    found = snapshot.page(after_id, skip, limit, compact) if snapshot is not None and not name_prefix else None
+    if found is not None:
+        body, count, last_id = found
+        headers = {"X-Next-Cursor": encode_cursor(last_id)} if count == limit else {}
+        return cached_response(request, body, make_etag(body), headers)
+
+    key = (skip, limit, after_id, name_prefix, compact)
+    entry = product_list_cache.get(key)
+    if entry is None:
+        generation = product_list_cache.generation
+        # Misses for the same page share one query. The generation is part of
+        # the key, so a read that starts after a write never joins one that
+        # started before it.
+        entry = await read_flights.do(("products", generation) + key, load_products_page, *key)
+        product_list_cache.set(key, entry, generation=generation)
+
+    return cached_response(request, *entry)
+
+async def load_products_page(skip, limit, after_id, name_prefix, compact):
+    async with SessionLocal() as db:
+        products = await crud.get_products(
+            db,
+            skip=skip,
+            limit=limit,
+            after_id=after_id,
+            name_prefix=name_prefix,
+            with_sellers=not compact
+        )
+        body = dump_json(List[schemas.ProductListing] if compact else List[schemas.Product], products)
+    headers = {}
+    if len(products) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(products[-1].id)
+    return (body, make_etag(body), headers)
+
+@router.get("/search", response_model=List[schemas.ProductListing])
+async def search_products(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_db)
+):
     """
-    products = await crud.get_products(db, skip=skip, limit=limit)
-    return products
+    Search master products by name and description, best matches first.
+    Every word is matched as a prefix. Pass the X-Next-Cursor response header
+    back as `cursor` to get the next page. Public can access.
+    """
+    terms = re.findall(r"\w+", q.lower())[:MAX_SEARCH_TERMS]
+    if not terms:
+        raise HTTPException(status_code=400, detail="Search query has no searchable words")
+
+    after = decode_cursor(cursor, float, int) if cursor is not None else None
+    results = await crud.search_products(db, terms, limit=limit, after=after)
+
+    headers = {}
+    if len(results) == limit:
+        last_product, last_rank = results[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last_rank, last_product.id)
+    return json_response(List[schemas.ProductListing], [product for product, _ in results], headers=headers)
 
 @router.get("/{product_id}", response_model=schemas.Product)
-async def read_product(product_id: int, db: AsyncSession = Depends(get_db)):
+async def read_product(request: Request, product_id: int):
     """
     Get a single master product by ID, including all sellers.
     Public can access.
     """
-    db_product = await crud.get_product(db, product_id=product_id)
-    if db_product is None:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return db_product
\ No newline at end of file
+    snapshot = current_snapshot()
+    found = snapshot.product(product_id) if snapshot is not None else None
+    if found is not None:
+        body, digest = found
+        return cached_response(request, body, '"%s"' % digest.hex(), {})
+
+    # Not in the snapshot, changed since, or no snapshot
+    entry = product_detail_cache.get(product_id)
+    if entry is None:
+        generation = product_detail_cache.generation
+        entry = await read_flights.do(("product_detail", generation, product_id), load_product, product_id)
+        product_detail_cache.set(product_id, entry, generation=generation)
+
+    return cached_response(request, *entry)
+
+async def load_product(product_id: int):
+    async with SessionLocal() as db:
+        db_product = await crud.get_product(db, product_id=product_id)
+        if db_product is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        body = dump_json(schemas.Product, db_product)
+    return (body, make_etag(body), {})
+
+def cached_response(request: Request, body: bytes, etag: str, headers: dict):
+    headers = {**headers, "ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
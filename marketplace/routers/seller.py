@@ -1,12 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-from typing import List
+from typing import List, Literal
 
-from .. import crud, schemas, models
-from ..database import get_db
-from ..dependencies import get_current_seller_user
+from .. import crud, schemas
+from ..bulk import iter_chunks
+from ..cache import product_list_cache
+from ..database import SessionLocal, get_db, settings
+from ..dependencies import get_current_seller_user, order_history_filters
+from ..events import event_stream
+from ..export import order_export_response
+from ..pagination import encode_cursor
+from ..serialization import dump_json, json_array, json_response
+from ..singleflight import read_flights
 
 router = APIRouter(
     prefix="/seller",
@@ -18,54 +25,159 @@ router = APIRouter(
 async def add_product_to_inventory(
     seller_product: schemas.SellerProductCreate,
     db: AsyncSession = Depends(get_db),
-    current_seller: schemas.User = Depends(get_current_seller_user)
+    current_seller: schemas.Principal = Depends(get_current_seller_user)
 ):
     """
     Allows a seller to add a MASTER product to their personal inventory,
     setting their own price and quantity.
     """
-    return await crud.add_product_to_seller_inventory(
+    db_seller_product = await crud.add_product_to_seller_inventory(
         db=db, seller_product=seller_product, seller_id=current_seller.id
     )
+    return json_response(schemas.SellerProduct, db_seller_product)
+
+@router.post("/inventory/bulk", response_model=schemas.BulkResult)
+async def bulk_add_products_to_inventory(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_seller: schemas.Principal = Depends(get_current_seller_user)
+):
+    """
+    Add or update many inventory entries from a streamed NDJSON body or a CSV
+    body with a header row (Content-Type: text/csv). Each row needs
+    product_id, price and quantity; products already in the inventory get the
+    new price and quantity. Invalid rows are reported by row number.
+    """
+    summary = schemas.BulkResult()
+    async for rows, errors in iter_chunks(request, schemas.SellerProductCreate, settings.BULK_CHUNK_SIZE):
+        created, updated, row_errors = await crud.bulk_upsert_seller_inventory(
+            db=db, items=rows, seller_id=current_seller.id
+        )
+        summary.created += created
+        summary.updated += updated
+        summary.errors.extend(schemas.BulkRowError(**error) for error in errors + row_errors)
+    summary.errors.sort(key=lambda error: error.row)
+    return summary
 
 @router.get("/inventory", response_model=List[schemas.SellerProduct])
 async def read_seller_inventory(
-    db: AsyncSession = Depends(get_db),
-    current_seller: schemas.User = Depends(get_current_seller_user)
+    current_seller: schemas.Principal = Depends(get_current_seller_user)
 ):
     """
     Get the inventory for the currently logged-in seller.
     """
-    return await crud.get_seller_inventory(db=db, seller_id=current_seller.id)
+    # Every stock change bumps the catalog generation, so a poll never joins a
+    # read that started before the seller's latest write
+    key = ("seller_inventory", product_list_cache.generation, current_seller.id)
+    body = await read_flights.do(key, load_seller_inventory, current_seller.id)
+    return Response(content=body, media_type="application/json")
+
+async def load_seller_inventory(seller_id: int):
+    async with SessionLocal() as db:
+        inventory = await crud.get_seller_inventory(db=db, seller_id=seller_id)
+        return dump_json(List[schemas.SellerProduct], inventory)
+
+@router.get("/events")
+async def stream_seller_events(
+    last_event_id: str | None = Header(None, max_length=64),
+    current_seller: schemas.Principal = Depends(get_current_seller_user)
+):
+    """
+    Server-Sent Events feed of the seller's new orders (`order.created`),
+    status changes (`order.status_changed`) and stock changes
+    (`stock.changed`), instead of polling the order and inventory lists.
+    Reconnecting with `Last-Event-ID` replays what was missed; a `reset` event
+    means the gap can't be replayed and the lists should be fetched again.
+    """
+    return StreamingResponse(
+        event_stream(current_seller.id, last_event_id),
+        media_type="text/event-stream",
+        # No buffering in nginx-style proxies
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/analytics", response_model=schemas.SellerAnalytics)
+async def read_seller_analytics(
+    bucket: Literal["day", "week", "month"] = "day",
+    start: date | None = None,
+    end: date | None = None,
+    db: AsyncSession = Depends(get_db),
+    current_seller: schemas.Principal = Depends(get_current_seller_user)
+):
+    """
+    Revenue, units sold and order counts of the currently logged-in seller by
+    order status, per period and per product. Orders count towards the UTC day
+    they were placed on; `start` and `end` are inclusive.
+    """
+    analytics = await crud.get_seller_analytics(
+        db, seller_id=current_seller.id, bucket=bucket, start=start, end=end
+    )
+    return json_response(schemas.SellerAnalytics, analytics)
 
 @router.get("/orders", response_model=List[schemas.Order])
 async def read_seller_orders(
+    filters: dict = Depends(order_history_filters),
+    db: AsyncSession = Depends(get_db),
+    current_seller: schemas.Principal = Depends(get_current_seller_user)
+):
+    """
+    Get the orders received by the currently logged-in seller, oldest first.
+    Filter with `status` (repeatable) and the `created_after` (inclusive) /
+    `created_before` (exclusive) range. Pass the X-Next-Cursor response header
+    back as `cursor` to get the next page.
+    """
+    orders = await crud.get_orders_for_seller(db=db, seller_id=current_seller.id, **filters)
+    headers = {}
+    if len(orders) == filters["limit"]:
+        last_id, last_created_at, _ = orders[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last_created_at.isoformat(), last_id)
+    return Response(content=json_array(body for _, _, body in orders), media_type="application/json", headers=headers)
+
+@router.get("/orders/export")
+async def export_seller_orders(
+    after_id: int | None = None,
+    current_seller: schemas.Principal = Depends(get_current_seller_user)
+):
+    """
+    Stream all orders received by the currently logged-in seller as NDJSON.
+    Pass the last received order id as `after_id` to resume.
+    """
+    return order_export_response(after_id=after_id, seller_id=current_seller.id)
+
+@router.post("/orders/status", response_model=schemas.OrderStatusBulkResult)
+async def bulk_manage_order_status(
+    bulk_update: schemas.OrderStatusBulkUpdate,
     db: AsyncSession = Depends(get_db),
-    current_seller: schemas.User = Depends(get_current_seller_user)
+    current_seller: schemas.Principal = Depends(get_current_seller_user)
 ):
     """
-    Get all orders received by the currently logged-in seller.
+    Confirm or cancel many PENDING orders of the seller at once. Cancelled
+    orders go back into stock. Orders that can't make the transition are
+    listed in `rejected` with the reason, the others are still updated.
     """
-    return await crud.get_orders_for_seller(db=db, seller_id=current_seller.id)
+    updated, rejected = await crud.bulk_update_order_status(
+        db=db, order_ids=bulk_update.order_ids, seller_id=current_seller.id, new_status=bulk_update.status
+    )
+    return json_response(schemas.OrderStatusBulkResult, {
+        "status": bulk_update.status,
+        "updated": updated,
+        "rejected": [{"order_id": order_id, "detail": detail} for order_id, detail in rejected],
+    })
 
 @router.put("/orders/{order_id}", response_model=schemas.Order)
 async def manage_order_status(
     order_id: int,
     order_update: schemas.OrderUpdate,
     db: AsyncSession = Depends(get_db),
-    current_seller: schemas.User = Depends(get_current_seller_user)
+    current_seller: schemas.Principal = Depends(get_current_seller_user)
 ):
     """
-    Allows a seller to update the status of one of their orders.
+    Allows a seller to confirm or cancel one of their PENDING orders.
+    Cancelled orders go back into stock.
     """
-    updated_order = await crud.update_order_status(
+    await crud.update_order_status(
         db=db, order_id=order_id, seller_id=current_seller.id, new_status=order_update.status
     )
-    
-    query = (
-        select(models.Order)
-        .options(selectinload(models.Order.items))
-        .filter(models.Order.id == updated_order.id)
-    )
-    result = await db.execute(query)
-    return result.scalars().first()
\ No newline at end of file
+    # Same body as the order lists, from the snapshot with the new status
+    body = await crud.get_order_json(db, order_id)
+    return Response(content=body, media_type="application/json")
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
@@ -6,26 +6,30 @@ from datetime import timedelta
 from .. import crud, schemas, security
 from ..database import get_db
 from ..dependencies import get_current_user
+from ..serialization import dump_json, json_array, json_response
 
 router = APIRouter(
     prefix="/users",
     tags=["users"],
 )
 
+EMPTY_ORDER_LISTS = b',"purchase_orders":[],"sale_orders":[]}'
+
 @router.post("/", response_model=schemas.User)
 async def create_new_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
-    db_user = await crud.get_user_by_email(db, email=user.email)
+    db_user = await crud.get_principal_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return await crud.create_user(db=db, user=user)
+    db_user = await crud.create_user(db=db, user=user)
+    return json_response(schemas.User, db_user)
 
 @router.post("/token", response_model=schemas.Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(), 
     db: AsyncSession = Depends(get_db)
 ):
-    user = await crud.get_user_by_email(db, email=form_data.username)
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    user = await crud.get_user_credentials(db, email=form_data.username)
+    if not user or not await security.check_password(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -39,5 +43,24 @@ async def login_for_access_token(
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/me", response_model=schemas.User)
-async def read_users_me(current_user: schemas.User = Depends(get_current_user)):
-    return current_user
\ No newline at end of file
+async def read_users_me(
+    current_user: schemas.Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    user = await crud.get_user_by_email(db, email=current_user.email)
+    purchase_orders, sale_orders = await crud.get_user_orders(db, user_id=user.id)
+    # The order lists are the last two fields, they are serialized empty and
+    # replaced with the stored order JSON
+    body = dump_json(schemas.User, {
+        "email": user.email,
+        "id": user.id,
+        "is_active": user.is_active,
+        "user_type": user.user_type,
+        "selling_products": user.selling_products,
+    })
+    if not body.endswith(EMPTY_ORDER_LISTS):
+        raise RuntimeError("schemas.User no longer ends with the order lists")
+    body = body[:-len(EMPTY_ORDER_LISTS)] + (
+        b',"purchase_orders":' + json_array(purchase_orders) + b',"sale_orders":' + json_array(sale_orders) + b"}"
+    )
+    return Response(content=body, media_type="application/json")
\ No newline at end of file
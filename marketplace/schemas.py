@@ -1,5 +1,19 @@
-from pydantic import BaseModel, EmailStr
-from typing import List
+from datetime import date, datetime, timezone
+from pydantic import AfterValidator, BaseModel, EmailStr, Field, WithJsonSchema
+from typing import Annotated, List, Literal
+
+# Emails read back from the database were validated by EmailStr when they were
+# written. Re-validating them on every response dominated serialization time
+# of the nested order schemas, so output schemas only document the format.
+StoredEmail = Annotated[str, WithJsonSchema({"type": "string", "format": "email"})]
+
+def as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+# Order times are written in UTC. SQLite reads them back without the zone, they
+# get it back so an order serializes the same whether it was just created,
+# reloaded or snapshotted.
+UtcDatetime = Annotated[datetime, AfterValidator(as_utc)]
 
 # Simple Schemas for Nesting, to prevent circular loops
 class ProductSimple(BaseModel):
@@ -12,7 +26,7 @@ class ProductSimple(BaseModel):
 
 class UserSimple(BaseModel):
     id: int
-    email: EmailStr
+    email: StoredEmail
 
     class Config:
         from_attributes = True
@@ -46,21 +60,84 @@ class UserCreate(UserBase):
     user_type: str
 
 class OrderItemCreate(OrderItemBase):
-    pass
+    quantity: int = Field(gt=0)
 
 class OrderCreate(BaseModel):
     seller_id: int
     items: List[OrderItemCreate]
 
+class CartItemCreate(OrderItemCreate):
+    pass
+
+class CartCheckout(BaseModel):
+    items: List[CartItemCreate] = Field(min_length=1)
+
 class OrderUpdate(BaseModel):
-    status: str
+    status: Literal["PENDING", "CONFIRMED", "CANCELED"]
+
+class OrderStatusBulkUpdate(BaseModel):
+    order_ids: List[int] = Field(min_length=1, max_length=1000)
+    status: Literal["CONFIRMED", "CANCELED"]
+
+class ReservationCreate(BaseModel):
+    seller_product_id: int
+    quantity: int = Field(gt=0)
+
+class ReservationCheckout(BaseModel):
+    reservation_ids: List[int] = Field(min_length=1)
 
 # Schemas for reading or output
 
+class BulkRowError(BaseModel):
+    row: int
+    detail: str
+
+class BulkResult(BaseModel):
+    created: int = 0
+    updated: int = 0
+    errors: List[BulkRowError] = []
+
+class StatusSales(BaseModel):
+    status: str
+    order_count: int
+    units_sold: int
+    revenue: float
+
+class PeriodSales(BaseModel):
+    period: date
+    status: str
+    order_count: int
+    units_sold: int
+    revenue: float
+
+class ProductSales(BaseModel):
+    period: date
+    product_id: int
+    status: str
+    order_count: int
+    units_sold: int
+    revenue: float
+
+class SellerAnalytics(BaseModel):
+    bucket: str
+    totals: List[StatusSales]
+    periods: List[PeriodSales]
+    products: List[ProductSales]
+
 class Token(BaseModel):
     access_token: str
     token_type: str
 
+# Slim authenticated user, resolved on every protected request
+class Principal(BaseModel):
+    id: int
+    email: StoredEmail
+    user_type: str
+    is_active: bool
+
+    class Config:
+        from_attributes = True
+
 class SellerProduct(SellerProductBase):
     id: int
     seller_id: int
@@ -78,6 +155,23 @@ class Product(ProductBase):
     class Config:
         from_attributes = True
 
+class OfferSummary(BaseModel):
+    min_price: float | None = None
+    seller_count: int = 0
+    total_quantity: int = 0
+    best_seller_id: int | None = None
+
+    class Config:
+        from_attributes = True
+
+# Catalog listing entry, with the offer summary instead of the nested sellers list
+class ProductListing(ProductBase):
+    id: int
+    offer_summary: OfferSummary | None = None
+
+    class Config:
+        from_attributes = True
+
 class OrderItem(OrderItemBase):
     id: int
     price_at_purchase: float
@@ -86,18 +180,53 @@ class OrderItem(OrderItemBase):
     class Config:
         from_attributes = True
 
+class Reservation(BaseModel):
+    id: int
+    seller_product_id: int
+    quantity: int
+    expires_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class OrderIntake(BaseModel):
+    id: int
+    status: str
+    status_url: str
+    order_id: int | None = None
+    status_code: int | None = None
+    detail: str | None = None
+
+    class Config:
+        from_attributes = True
+
 class Order(BaseModel):
     id: int
     buyer_id: int
     seller_id: int
     total_price: float
     status: str
+    created_at: UtcDatetime | None = None
     items: List[OrderItem]
 
     class Config:
         from_attributes = True
 
+class OrderStatusRejection(BaseModel):
+    order_id: int
+    detail: str
+
+class OrderStatusBulkResult(BaseModel):
+    status: str
+    updated: List[int]
+    rejected: List[OrderStatusRejection]
+
+class CartCheckoutResult(BaseModel):
+    orders: List[Order]
+    round_trips: int | None = None
+
 class User(UserBase):
+    email: StoredEmail
     id: int
     is_active: bool
     user_type: str
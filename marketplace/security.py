@@ -1,4 +1,7 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from .database import settings
@@ -6,9 +9,42 @@ from .database import settings
 # Password Hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
+# bcrypt takes hundreds of milliseconds and releases the GIL, so it runs on a
+# dedicated thread pool instead of blocking the event loop. Jobs beyond the
+# workers plus the queue limit are rejected right away with a 503.
+password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password"
+)
+password_jobs = 0
+
+async def run_password_job(func, *args):
+    global password_jobs
+    if password_jobs >= settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many authentication requests, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+
+    password_jobs += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(password_executor, func, *args)
+    finally:
+        password_jobs -= 1
+
+async def hash_password(password):
+    return await run_password_job(get_password_hash, password)
+
+async def check_password(plain_password, hashed_password):
+    return await run_password_job(verify_password, plain_password, hashed_password)
+
 # JWT Token Creation
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -20,4 +56,4 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     
     # Use SECRET_KEY and ALGORITHM from .env
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
-    return encoded_jwt
\ No newline at end of file
+    return encoded_jwt
@@ -0,0 +1,47 @@
+"""
+Single-flight coalescing for hot reads.
+
+Concurrent callers asking for the same key share one execution of the
+loader and its result. Nothing is kept once the call finishes, caching stays
+the job of cache.py.
+"""
+import asyncio
+
+class SingleFlight:
+    def __init__(self):
+        # Per route: [calls, executions]
+        self.counters = {}
+        self._flights = {}
+
+    async def do(self, key: tuple, loader, *args):
+        """
+        Run `loader(*args)` unless a call for `key` is already in flight, in
+        which case wait for that one. key[0] names the route for the metrics.
+        Loaders must not use the caller's session, and the result is shared,
+        so return something immutable such as serialized bytes.
+        """
+        counters = self.counters.setdefault(key[0], [0, 0])
+        counters[0] += 1
+        future = self._flights.get(key)
+        if future is None:
+            counters[1] += 1
+            future = asyncio.ensure_future(loader(*args))
+            self._flights[key] = future
+            future.add_done_callback(lambda _: self._flights.pop(key, None))
+        # A caller that goes away must not cancel the call the others wait on
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {
+            route: {
+                "calls": calls,
+                "executions": executions,
+                "fan_in": round(calls / executions, 3) if executions else 0.0,
+            }
+            for route, (calls, executions) in self.counters.items()
+        }
+
+    def __len__(self):
+        return len(self._flights)
+
+read_flights = SingleFlight()
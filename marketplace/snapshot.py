@@ -0,0 +1,377 @@
+"""
+Catalog snapshot shared by all worker processes through a memory-mapped file.
+
+The file holds every product serialized twice, as the full schemas.Product
+(detail and listing with sellers) and as the compact schemas.ProductListing,
+each in product id order and separated by commas. Product pages are then one
+contiguous slice of the file, and a product detail is served straight from
+the mapping without copying.
+
+Layout, little endian:
+
+    header   magic, product count, offsets of the two blobs
+    index    one entry per product, sorted by id: id, sha1 of the detail,
+             offset and length in each blob
+    blobs    full JSON entries, then compact JSON entries
+
+Workers that change products patch their entries into the file under an
+exclusive file lock: only the changed products are loaded and serialized, the
+other entries are copied over from the current file. The result is swapped in
+with os.replace, so readers only ever map a complete file. Until its patch is
+in, a worker serves the products it changed, and pages containing them, from
+the database. The whole file is only rebuilt when a worker starts and after
+bulk product imports.
+"""
+import asyncio
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+from sqlalchemy.future import select
+from sqlalchemy.orm import joinedload, selectinload
+
+from . import models, schemas
+from .cache import catalog_listeners
+from .database import SessionLocal, settings
+from .serialization import dump_json
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MKTCAT01"
+HEADER = struct.Struct("<8sIQQ")
+INDEX_ENTRY = struct.Struct("<q20sQIQI")
+
+class CatalogSnapshot:
+    def __init__(self, path: str):
+        self.path = path
+        self.changes = 0
+        # Change number of the last change that needs a full rebuild, and of
+        # the last change of each product not patched in yet
+        self.stale_all = None
+        self.stale = {}
+        self.changed = asyncio.Event()
+        self.hits = 0
+        self.misses = 0
+        self.full_builds = 0
+        self.patches = 0
+        self._mapping = None
+        self._file_id = None
+        self._checked_at = 0.0
+
+    def mark_changed(self, product_ids=None):
+        self.changes += 1
+        if product_ids is None:
+            self.stale_all = self.changes
+        else:
+            for product_id in product_ids:
+                self.stale[product_id] = self.changes
+        self.changed.set()
+
+    def current(self):
+        """
+        The mapped snapshot, or None when reads should go to the database: no
+        snapshot yet, or it is waiting for a full rebuild.
+        """
+        if self.stale_all is not None:
+            return None
+        now = time.monotonic()
+        if now - self._checked_at >= settings.CATALOG_SNAPSHOT_CHECK_INTERVAL_SECONDS:
+            self._checked_at = now
+            self._remap_if_replaced()
+        return self._mapping
+
+    def product(self, product_id: int):
+        """
+        SnapshotMapping.product, or None when the product changed since.
+        """
+        mapping = self.current()
+        found = None
+        if mapping is not None and product_id not in self.stale:
+            found = mapping.product(product_id)
+        self.count(found is not None)
+        return found
+
+    def page(self, after_id: int | None, skip: int, limit: int, compact: bool):
+        """
+        SnapshotMapping.page, or None when a product on the page changed
+        since. Products are only ever added at the end, a changed id past a
+        short last page may be a new one.
+        """
+        mapping = self.current()
+        found = None
+        if mapping is not None:
+            found = mapping.page(after_id, skip, limit, compact)
+            _, count, last_id = found
+            for product_id in self.stale:
+                if (after_id is None or product_id > after_id) and (count < limit or product_id <= last_id):
+                    found = None
+                    break
+        self.count(found is not None)
+        return found
+
+    def count(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_products": len(self.stale),
+            "full_builds": self.full_builds,
+            "patches": self.patches,
+        }
+
+    def _remap_if_replaced(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._mapping, self._file_id = None, None
+            return
+        file_id = (stat.st_ino, stat.st_mtime_ns)
+        if file_id == self._file_id:
+            return
+        # The previous mapping is not closed, responses may still be sending
+        # slices of it. It goes away with its last reference.
+        self._mapping, self._file_id = map_snapshot(self.path), file_id
+
+    async def rebuild(self):
+        changes = self.changes
+        full = self.stale_all is not None
+        product_ids = sorted(self.stale)
+        with open(self.path + ".lock", "a+b") as lock:
+            # Writers of all workers take turns, each one loads its products
+            # after the previous one swapped its file in
+            await asyncio.to_thread(fcntl.flock, lock.fileno(), fcntl.LOCK_EX)
+            try:
+                previous = None if full else map_snapshot(self.path)
+                directory = os.path.dirname(os.path.abspath(self.path))
+                writer = SnapshotWriter(directory)
+                try:
+                    if previous is None:
+                        await build_snapshot(writer)
+                        self.full_builds += 1
+                    else:
+                        await patch_snapshot(writer, previous, product_ids)
+                        self.patches += 1
+                    writer.replace(self.path)
+                finally:
+                    writer.close()
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+        # Changes made while this ran wait for the next round
+        if self.stale_all is not None and self.stale_all <= changes:
+            self.stale_all = None
+        for product_id in product_ids:
+            if self.stale.get(product_id, changes + 1) <= changes:
+                del self.stale[product_id]
+        self._checked_at = 0.0
+
+def map_snapshot(path: str):
+    """
+    SnapshotMapping of the file at `path`, or None if there is none.
+    """
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with file:
+        return SnapshotMapping(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+class SnapshotMapping:
+    def __init__(self, data: mmap.mmap):
+        magic, self.count, self.full_offset, self.compact_offset = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a catalog snapshot")
+        self.data = data
+        self.view = memoryview(data)
+
+    def entry(self, position: int):
+        return INDEX_ENTRY.unpack_from(self.data, HEADER.size + position * INDEX_ENTRY.size)
+
+    def bisect(self, product_id: int, after: bool = False) -> int:
+        """
+        Position of the first entry with an id >= product_id, or > product_id
+        with after=True.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            middle_id = self.entry(middle)[0]
+            if middle_id < product_id or (after and middle_id == product_id):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def product(self, product_id: int):
+        """
+        (JSON body, sha1) of a product detail, or None. The body is a slice
+        of the mapping, not a copy.
+        """
+        position = self.bisect(product_id)
+        if position == self.count:
+            return None
+        entry_id, digest, full_offset, full_length, _, _ = self.entry(position)
+        if entry_id != product_id:
+            return None
+        start = self.full_offset + full_offset
+        return self.view[start:start + full_length], digest
+
+    def page(self, after_id: int | None, skip: int, limit: int, compact: bool):
+        """
+        JSON array of up to `limit` products in id order, the number of
+        products in it and the id of the last one.
+        """
+        first = (self.bisect(after_id, after=True) if after_id is not None else 0) + skip
+        last = min(first + limit, self.count) - 1
+        if first > last:
+            return b"[]", 0, None
+        _, _, first_full, _, first_compact, _ = self.entry(first)
+        last_id, _, last_full, last_full_length, last_compact, last_compact_length = self.entry(last)
+        if compact:
+            start, end = self.compact_offset + first_compact, self.compact_offset + last_compact + last_compact_length
+        else:
+            start, end = self.full_offset + first_full, self.full_offset + last_full + last_full_length
+        return b"[" + self.view[start:end] + b"]", last - first + 1, last_id
+
+class SnapshotWriter:
+    """
+    Writes a snapshot file entry by entry. The two blobs are spooled to
+    temporary files, only the index is kept in memory.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index = []
+        self.full = tempfile.TemporaryFile(dir=directory)
+        self.compact = tempfile.TemporaryFile(dir=directory)
+        self.full_size = 0
+        self.compact_size = 0
+
+    def add(self, product_id: int, digest: bytes, full_entry, compact_entry):
+        if self.index:
+            self.full.write(b",")
+            self.compact.write(b",")
+            self.full_size += 1
+            self.compact_size += 1
+        self.index.append((
+            product_id, digest,
+            self.full_size, len(full_entry),
+            self.compact_size, len(compact_entry),
+        ))
+        self.full.write(full_entry)
+        self.compact.write(compact_entry)
+        self.full_size += len(full_entry)
+        self.compact_size += len(compact_entry)
+
+    def add_product(self, product):
+        full_entry = dump_json(schemas.Product, product)
+        compact_entry = dump_json(schemas.ProductListing, product)
+        self.add(product.id, hashlib.sha1(full_entry).digest(), full_entry, compact_entry)
+
+    def replace(self, path: str):
+        full_offset = HEADER.size + len(self.index) * INDEX_ENTRY.size
+        with tempfile.NamedTemporaryFile(dir=self.directory, prefix=".catalog-", delete=False) as file:
+            file.write(HEADER.pack(MAGIC, len(self.index), full_offset, full_offset + self.full_size))
+            for entry in self.index:
+                file.write(INDEX_ENTRY.pack(*entry))
+            for blob in (self.full, self.compact):
+                blob.seek(0)
+                shutil.copyfileobj(blob, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(file.name, path)
+
+    def close(self):
+        self.full.close()
+        self.compact.close()
+
+def catalog_query():
+    return (
+        select(models.Product)
+        .options(
+            selectinload(models.Product.sellers).options(
+                selectinload(models.SellerProduct.product),
+                selectinload(models.SellerProduct.seller)
+            ),
+            joinedload(models.Product.offer_summary)
+        )
+        .order_by(models.Product.id)
+    )
+
+async def build_snapshot(writer: SnapshotWriter):
+    async with SessionLocal() as db:
+        result = await db.stream(catalog_query().execution_options(yield_per=settings.EXPORT_BATCH_SIZE))
+        async for batch in result.scalars().partitions():
+            for product in batch:
+                writer.add_product(product)
+            # Written out, the next batch doesn't need them
+            db.expunge_all()
+
+async def patch_snapshot(writer: SnapshotWriter, previous: SnapshotMapping, product_ids: list[int]):
+    """
+    Copy `previous` into `writer`, with the entries of `product_ids` loaded
+    from the database again. Ids missing from `previous` are added, ids
+    missing from the database are left out.
+    """
+    async with SessionLocal() as db:
+        result = await db.execute(catalog_query().filter(models.Product.id.in_(product_ids)))
+        changed = result.scalars().all()
+
+    deleted = set(product_ids) - {product.id for product in changed}
+    position = 0
+    for product in changed:
+        # Entries before the next changed product are copied as they are
+        end = previous.bisect(product.id)
+        copy_entries(writer, previous, position, end, deleted)
+        writer.add_product(product)
+        position = end + (end < previous.count and previous.entry(end)[0] == product.id)
+    copy_entries(writer, previous, position, previous.count, deleted)
+
+def copy_entries(writer: SnapshotWriter, previous: SnapshotMapping, start: int, end: int, deleted):
+    for position in range(start, end):
+        product_id, digest, full_offset, full_length, compact_offset, compact_length = previous.entry(position)
+        if product_id in deleted:
+            continue
+        full_start = previous.full_offset + full_offset
+        compact_start = previous.compact_offset + compact_offset
+        writer.add(
+            product_id, digest,
+            previous.view[full_start:full_start + full_length],
+            previous.view[compact_start:compact_start + compact_length],
+        )
+
+catalog_snapshot = CatalogSnapshot(settings.CATALOG_SNAPSHOT_PATH) if settings.CATALOG_SNAPSHOT_PATH else None
+
+def current_snapshot():
+    return catalog_snapshot if catalog_snapshot is not None and catalog_snapshot.current() is not None else None
+
+async def run_snapshot_builder():
+    """
+    Patch the snapshot after catalog changes made by this worker, at most
+    once per CATALOG_SNAPSHOT_MIN_INTERVAL_SECONDS.
+    """
+    catalog_listeners.append(catalog_snapshot.mark_changed)
+    # Whatever is on disk may predate this deploy
+    catalog_snapshot.mark_changed()
+    while True:
+        await catalog_snapshot.changed.wait()
+        catalog_snapshot.changed.clear()
+        try:
+            await catalog_snapshot.rebuild()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Catalog snapshot rebuild failed")
+            catalog_snapshot.changed.set()
+        await asyncio.sleep(settings.CATALOG_SNAPSHOT_MIN_INTERVAL_SECONDS)